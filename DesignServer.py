@@ -0,0 +1,31 @@
+import argparse
+import signal
+import sys
+from PrimerServer import DesignServer, serve_socket, serve_stream
+
+
+if __name__ == '__main__':
+    # argument parser for command line
+    parser = argparse.ArgumentParser(description='Primer design server')
+    parser.add_argument('-s', '--socket', help='Unix socket to serve requests on, rather than stdin/stdout',
+                        default=None)
+    parser.add_argument('-w', '--workers', help='Number of worker processes to design primers with', default=1)
+    parser.add_argument('-t', '--threads', help='Number of requests to work on at once', default=4)
+    parser.add_argument('-q', '--queue-size', help='Max number of requests waiting to be worked on', default=64)
+    parser.add_argument('-c', '--cache', help='Directory to cache Primer3 results in between runs', default=None)
+    parser.add_argument('--cache-size', help='Max size of the Primer3 result cache in MB', default=1024)
+    args = parser.parse_args()
+
+    server = DesignServer(int(args.workers), args.cache, int(args.cache_size), int(args.queue_size), int(args.threads))
+    # stop in the same way on kill as on Ctrl-C, finishing the requests already taken and removing the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        if args.socket:
+            print('Serving on %s' % args.socket, file=sys.stderr)
+            serve_socket(server, args.socket)
+        else:
+            serve_stream(server, sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
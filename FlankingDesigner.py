@@ -2,178 +2,248 @@ __author__ = 'Joshua Ball (joshua.ball@earlham.ac.uk)'
 __version__ = '1.0.2'
 
 import argparse
-import primer3
-from Bio import SeqIO
-import csv
+import collections
+import functools
+import os
+import sys
 from datetime import datetime
 from PrimerFilters import *
-
-# argument parser for command line
-parser = argparse.ArgumentParser(description='Primer Designer')
-parser.add_argument('-i', '--input', help='Input file name', required=True)
-parser.add_argument('-n', '--number', help='Number of Primer pairs to return', default=5)
-parser.add_argument('-l', '--lower', help='Min Primer Product Length', default=200)
-parser.add_argument('-u', '--upper', help='Max Primer Product Length', default=500)
-args = parser.parse_args()
-
-# create the .csv file and enter headers. Also assign date and time stamped names for CSV and TXT files to be made.
-csvfilename = 'LF-RF Primers '+datetime.today().strftime('%y-%m-%d %H.%M.%S')+'.csv'
-headings = ['Gene', 'Primer', 'Flank', 'Pair Penalty', 'Left Penalty', 'Right Penalty',
-            'Primer Forward', 'Primer Reverse', 'Left (Start, Length)', 'Right (Start, Length)', 'Left TM', 'Right TM',
-            'Left GC%', 'Right GC%', 'Left Self Any TH', 'Right Self Any TH', 'Left Self End TH', 'Right Self End TH',
-            'Left Hairpin TH', 'Right Hairpin TH', 'Left End Stability', 'Right End Stability', 'Pair Compl Any TH',
-            'Pair Compl End TH', 'Pair Product Size', 'bsaI in Product', 'bsaI Start', 'bsmbI in Product',
-            'bsmbI Start', 'bspqI in Product', 'bspqI Start', 'btgzI in Product', 'btgzI Start',
-            'Primer Product Sequence']
-with open(csvfilename, 'w') as f:
-    writer = csv.DictWriter(f, fieldnames=headings)
-    writer.writeheader()
-    f.close()
-
-# using BioPython to get info from fasta file.
-# 'Whole Chromosome CDS list 1000bp.fasta' 'Test_Genes.fasta'
-myfast = SeqIO.parse(str(args.input), 'fasta') #str(args.input)
-for seq_record in myfast:
-    ID = seq_record.id
-    SEQ = str(seq_record.seq)
-    CDS_len = sum(1 for c in SEQ if c.isupper())
-    CDS_start = SEQ.find(find_CDS_start(SEQ))
+from PrimerCache import DesignCache, design_primers, open_cache
+from PrimerFasta import FastaFile
+from PrimerMetrics import MeasuredDesign, MetricsCollector, profile
+from PrimerOutput import formats, open_writer
+from PrimerParallel import ordered_map
+from PrimerRecords import csv_headings, primer_pairs
+from PrimerShards import parse_shard, shard_of
+
+# the shortest primer primer3 is asked for (PRIMER_MIN_SIZE). The k-mers looked up in a genome can't be longer.
+min_primer_size = 18
+
+
+# function that designs the primers for one flanking region record, given as an (ID, sequence) tuple, and returns the
+# list of PrimerPairs. Kept at module level so that it can be sent to worker processes. With prescreen, the parts of
+# the template that no oligo within primer3's GC and Tm limits could overlap are excluded before primer3 is called (see
+# PrimerPrescreen), which gives the same primers. Records that primers can't be designed for (see RecordLayout) are
+# skipped with a message, giving no pairs.
+def design_record(record, num, lower, upper, scanner, prescreen=False):
+    ID, SEQ = record
+    layout = RecordLayout(SEQ, lower)
+    if layout.problems:
+        print('Skipping %s: %s' % (ID, ', '.join(layout.problems)), file=sys.stderr)
+        return []
+    CDS_len = layout.cds_len
+    CDS_start = layout.cds_start
     #print(ID)
     #print(SEQ)
-    #print(find_CDS_start(SEQ))
     #print("CDS Start = ", CDS_start)
     #print("CDS Length = ", CDS_len)
 
     # Use Primer 3 and get results for Left Flanking Region.
-    num = int(args.number)  # number of primer pairs to generate.
-    lower = int(args.lower)
-    upper = int(args.upper)
-
     if SEQ[0].isupper():
         target_start = (CDS_start + (CDS_len - 2))
         flank = 'Right'
     else:
         target_start = CDS_start
         flank = 'Left'
-
-    primerlist = (primer3.bindings.designPrimers(
-        {
-            'SEQUENCE_ID': ID,
-            'SEQUENCE_TEMPLATE': SEQ,
-            'SEQUENCE_TARGET': [target_start, 3]
-        },
-        {
-            'PRIMER_TASK': 'generic',
-            'PRIMER_PICK_LEFT_PRIMER': 1,
-            'PRIMER_PICK_RIGHT_PRIMER': 1,
-            'PRIMER_NUM_RETURN': num,
-            'PRIMER_OPT_SIZE': 20,
-            'PRIMER_MIN_SIZE': 18,
-            'PRIMER_MAX_SIZE': 30,
-            'PRIMER_PRODUCT_SIZE_RANGE': [lower, upper],
-            'PRIMER_OPT_TM': 55,
-            'PRIMER_MIN_TM': 50,
-            'PRIMER_MAX_TM': 60,
-            'PRIMER_EXPLAIN_FLAG': 1,
-            'PRIMER_MAX_END_STABILITY': 6.0,
-            'PRIMER_MIN_GC': 44.0,
-            'PRIMER_OPT_GC_PERCENT': 50.0,
-            'PRIMER_MAX_GC': 80.0
-        }
-    ))
+    # primer3 rejects a target that runs past the end of the template, as it does for a record with no bases after its
+    # CDS
+    if target_start + 3 > len(SEQ):
+        print('Skipping %s: the target (bases %d-%d) runs past the end of the record' %
+              (ID, target_start, target_start + 2), file=sys.stderr)
+        return []
+
+    global_args = {
+        'PRIMER_TASK': 'generic',
+        'PRIMER_PICK_LEFT_PRIMER': 1,
+        'PRIMER_PICK_RIGHT_PRIMER': 1,
+        'PRIMER_NUM_RETURN': num,
+        'PRIMER_OPT_SIZE': 20,
+        'PRIMER_MIN_SIZE': min_primer_size,
+        'PRIMER_MAX_SIZE': 30,
+        'PRIMER_PRODUCT_SIZE_RANGE': [lower, upper],
+        'PRIMER_OPT_TM': 55,
+        'PRIMER_MIN_TM': 50,
+        'PRIMER_MAX_TM': 60,
+        'PRIMER_EXPLAIN_FLAG': 1,
+        'PRIMER_MAX_END_STABILITY': 6.0,
+        'PRIMER_MIN_GC': 44.0,
+        'PRIMER_OPT_GC_PERCENT': 50.0,
+        'PRIMER_MAX_GC': 80.0
+    }
+    seq_args = {
+        'SEQUENCE_ID': ID,
+        'SEQUENCE_TEMPLATE': SEQ,
+        'SEQUENCE_TARGET': [target_start, 3],
+        # always given, even if empty, as primer3-py otherwise keeps the excluded regions of the previous call
+        'SEQUENCE_EXCLUDED_REGION': []
+    }
+    # Only imported here as it needs numpy
+    if prescreen:
+        from PrimerPrescreen import hopeless_regions
+        seq_args['SEQUENCE_EXCLUDED_REGION'] = hopeless_regions(SEQ, global_args)
+    primerlist = design_primers(seq_args, global_args)
     # print(primerlist)
     # primerlist is the initial output of primer3
 
-    newlist = cleanupdata(primerlist)
-    # print(newlist)
-    # newlist is a filtered version of primerlist, number of primers returned and explains have been removed
-
-    # Separate the data based on the primer number in each key! This results in a dictionary of sub-dictionaries where a
-    # sub-dictionary is a primer pair
-    reg = re.compile(r'\d+')  # regex that finds the number (primer number) in the keys (e.g. PRIMER_PAIR_0_PENALTY)
-    splitprimers = {}  # This will be the dictionary that all sub-dictionaries go into
-    for k, v in newlist.items():
-        m = reg.search(k)
-        if m:
-            numb = m.group()
-            splitprimers.setdefault(numb, {})[k] = v
-        else:
-            print('Invalid key:', k, v)
-
-    # print(splitprimers)
-
-    # This adds 2 new keys and values to each primer-pair dictionary. 1 for the Primer pair number, and 1 for the Gene ID
-    # This also then turns the dictionary of sub-dictionaries into a LIST of dictionaries called primers, this is important
-    # for further steps.
-
-    primers = []
-    for j in splitprimers:
-        splitprimers[j]['Primer'] = str(int(j) + 1)
-        splitprimers[j]['Gene'] = ID
-        splitprimers[j]['Flank'] = flank
-        primers.append(splitprimers[j])
-
-    # print(primers)
-
-    # Check for bsaI and filter primers to remove any that contain bsaI
-
-    fprimers = []
-    check = re.compile(r'PRIMER_LEFT_\d+$')
-    check2 = re.compile(r'PRIMER_RIGHT_\d+$')
-    for i in primers:
-        for j in i:
-            if check.search(j):
-                primerstart = i[j][0]
-            elif check2.search(j):
-                primerend = i[j][0] + 1
-        primer = SEQ[primerstart:primerend]
-        if bsa_in_primer(primer):
-            i['bsaI in Primer'] = 'Yes'
-            i['Primer Product'] = primer
-            fprimers.append(i)
-        else:
-            i['bsaI in Primer'] = 'No'
-            i['Primer Product'] = primer
-            fprimers.append(i)
-
-        if bsmbI_in_primer(primer):
-            i['bsmbI in Product'] = 'Yes'
-            r1 = re.search(r'cgtctc', primer) or re.search(r'gagacg', primer)
-            i['bsmbI Start'] = r1.start()
-        else:
-            i['bsmbI in Product'] = 'No'
-            i['bsmbI Start'] = 'n/a'
-
-        if bspqI_in_primer(primer):
-            i['bspqI in Product'] = 'Yes'
-            r2 = re.search(r'gctcttc', primer) or re.search(r'gaagagc', primer)
-            i['bspqI Start'] = r2.start()
-        else:
-            i['bspqI in Product'] = 'No'
-            i['bspqI Start'] = 'n/a'
-
-        if btgzI_in_primer(primer):
-            i['btgzI in Product'] = 'Yes'
-            r3 = re.search(r'gcgatg', primer) or re.search(r'catcgc', primer)
-            i['btgzI Start'] = r3.start()
-        else:
-            i['btgzI in Product'] = 'No'
-            i['btgzI Start'] = 'n/a'
-
-    # print(fprimers)
-
-    fprimers = replacekey(fprimers)
-    # print(fprimers)
-
-    # Output .txt or .csv
-    headings = ['Gene', 'Primer', 'Flank', 'Pair Penalty', 'Left Penalty',
-                'Right Penalty', 'Primer Forward', 'Primer Reverse', 'Left (Start, Length)', 'Right (Start, Length)',
-                'Left TM', 'Right TM', 'Left GC%', 'Right GC%', 'Left Self Any TH', 'Right Self Any TH',
-                'Left Self End TH', 'Right Self End TH', 'Left Hairpin TH', 'Right Hairpin TH', 'Left End Stability',
-                'Right End Stability', 'Pair Compl Any TH', 'Pair Compl End TH', 'Pair Product Size','bsaI in Product',
-                'bsaI Start', 'bsmbI in Product', 'bsmbI Start', 'bspqI in Product', 'bspqI Start', 'btgzI in Product',
-                'btgzI Start', 'Primer Product Sequence']
-    with open(csvfilename, 'a') as f:
-        writer = csv.DictWriter(f, fieldnames=headings)
-        writer.writerows(fprimers)
-        f.close()
+    # Turn the primer3 result into PrimerPairs, then check the theoretical product of each pair for bsaI and the other
+    # enzymes on both strands and in either case.
+    return primer_pairs(primerlist, ID, flank, SEQ, scanner)
+
+
+# default settings for design_flanking, the same as the command line defaults. enzymes is a dictionary of restriction
+# enzyme names and recognition sites, cache a directory to cache primer3 results in (or None) and cache_size its max
+# size in MB. metrics can be a PrimerMetrics.MetricsCollector to add the timings of each record to. If genome is a
+# FASTA file, the 3' end (the last kmer bases, with up to mismatches mismatches) of each primer is looked up in it and
+# pairs with a primer binding more than max_hits places are dropped (see PrimerSpecificity). prescreen excludes the
+# parts of the templates that can't hold a primer within primer3's GC and Tm limits before primer3 is called.
+default_params = {'number': 5, 'lower': 200, 'upper': 500, 'enzymes': default_enzymes, 'prescreen': False,
+                  'workers': 1, 'cache': None, 'cache_size': 1024, 'metrics': None, 'genome': None, 'kmer': 15,
+                  'mismatches': 1, 'max_hits': None}
+
+
+# function to return design_record with the settings in params filled in, which can be sent to worker processes
+def record_design(params):
+    return functools.partial(design_record, num=params['number'], lower=params['lower'], upper=params['upper'],
+                             scanner=RestrictionScanner(params['enzymes']), prescreen=params['prescreen'])
+
+
+# function to check that the k-mer looked up in the genome (if there is one) is no longer than the shortest primer, so
+# that a run doesn't stop part way through when a short primer can't be looked up
+def check_kmer(params):
+    if params['genome'] is not None and params['kmer'] > min_primer_size:
+        raise ValueError('The k-mer length (%d) must be at most the shortest primer length (%d)'
+                         % (params['kmer'], min_primer_size))
+
+
+# function to design the primers for an iterable of (ID, sequence) records, yielding the list of PrimerPairs of each
+# record in the same order as the records. params only needs the settings that differ from default_params. Records are
+# read and designed lazily, so this can be used on a genome sized input or called again for each small job.
+def design_flanking_records(records, params=None):
+    params = dict(default_params, **(params or {}))
+    check_kmer(params)
+    design = record_design(params)
+    initargs = (params['cache'], params['cache_size'] * 1024 ** 2)
+    # Records are designed in parallel when workers > 1, but still come back in input order.
+    if params['metrics'] is None:
+        designed = ordered_map(design, records, params['workers'], initializer=open_cache, initargs=initargs)
+    else:
+        designed = params['metrics'].collect(ordered_map(MeasuredDesign(design), records, params['workers'],
+                                                         initializer=open_cache, initargs=initargs))
+    if params['genome'] is None:
+        yield from designed
+        return
+
+    # Only imported here as it needs numpy. The primers are checked in this process, so the index is opened just once.
+    from PrimerSpecificity import KmerIndex, check_pairs
+    index = KmerIndex(params['genome'], params['kmer'])
+    for pairs in designed:
+        yield check_pairs(index, pairs, params['mismatches'], max_hits=params['max_hits'])
+
+
+# function to design the primers for an iterable of (ID, sequence) records, yielding every PrimerPair in turn
+def design_flanking(records, params=None):
+    for pairs in design_flanking_records(records, params):
+        yield from pairs
+
+
+if __name__ == '__main__':
+    # argument parser for command line
+    parser = argparse.ArgumentParser(description='Primer Designer')
+    parser.add_argument('-i', '--input', help='Input file name', required=True)
+    parser.add_argument('-n', '--number', help='Number of Primer pairs to return', default=5)
+    parser.add_argument('-l', '--lower', help='Min Primer Product Length', default=200)
+    parser.add_argument('-u', '--upper', help='Max Primer Product Length', default=500)
+    parser.add_argument('-w', '--workers', help='Number of worker processes to design primers with', default=1)
+    parser.add_argument('-c', '--cache', help='Directory to cache Primer3 results in between runs', default=None)
+    parser.add_argument('--cache-size', help='Max size of the Primer3 result cache in MB', default=1024)
+    parser.add_argument('-e', '--enzymes', help='Table of restriction enzyme names and sites to look for', default=None)
+    parser.add_argument('-r', '--resume', help='.csv file of an interrupted run to carry on with', default=None)
+    parser.add_argument('--shard', help='Only design the records in shard i of N (given as i/N), by a hash of their ID',
+                        default=None)
+    parser.add_argument('-f', '--format', help='Output format (parquet falls back to npz without pyarrow)',
+                        choices=list(formats), default='csv')
+    parser.add_argument('--coordinates', help='Write the start and end of each product instead of its sequence',
+                        action='store_true')
+    parser.add_argument('--prescreen', help='Exclude regions no primer could pass the GC and Tm limits in beforehand',
+                        action='store_true')
+    parser.add_argument('-m', '--metrics', help='Write timings of each gene and primer3 call next to the .csv',
+                        action='store_true')
+    parser.add_argument('--profile', help='File to write cProfile stats of the run to', default=None)
+    parser.add_argument('-g', '--genome', help='Genome FASTA file to look up where the primers bind in', default=None)
+    parser.add_argument('--kmer', help="Number of bases at the primers' 3' end to look up in the genome", default=15)
+    parser.add_argument('--mismatches', help="Mismatches allowed in the 3' end looked up (not in its last 3 bases)",
+                        default=1)
+    parser.add_argument('--max-hits', help='Drop pairs with a primer binding more places than this in the genome',
+                        default=None)
+    args = parser.parse_args()
+    shard = parse_shard(args.shard) if args.shard else None
+    if args.genome and int(args.kmer) > min_primer_size:
+        parser.error('--kmer must be at most %d, the shortest primer length' % min_primer_size)
+
+    params = {'number': int(args.number), 'lower': int(args.lower), 'upper': int(args.upper),
+              'enzymes': load_enzymes(args.enzymes) if args.enzymes else default_enzymes,
+              'prescreen': args.prescreen, 'workers': int(args.workers), 'cache': args.cache,
+              'cache_size': int(args.cache_size),
+              'metrics': MetricsCollector() if args.metrics else None, 'genome': args.genome,
+              'kmer': int(args.kmer), 'mismatches': int(args.mismatches),
+              'max_hits': int(args.max_hits) if args.max_hits is not None else None}
+    if args.cache:
+        cache = DesignCache(args.cache, params['cache_size'] * 1024 ** 2)
+        cache_before = cache.stats()
+
+    # create the .csv file and enter headers, or pick up the .csv of an interrupted run. Also assign date and time
+    # stamped names for CSV and TXT files to be made.
+    if args.resume:
+        csvfilename = args.resume
+    else:
+        csvfilename = 'LF-RF Primers '+datetime.today().strftime('%y-%m-%d %H.%M.%S')+formats[args.format]
+        if shard:
+            csvfilename = csvfilename[:-len(formats[args.format])] + ' shard %d of %d' % shard + formats[args.format]
+    settings = {key: params[key] for key in ['number', 'lower', 'upper', 'enzymes']}
+    if args.genome:
+        settings.update({key: params[key] for key in ['genome', 'kmer', 'mismatches', 'max_hits']})
+    if args.format != 'csv' or args.coordinates:
+        settings.update({'format': args.format, 'coordinates': args.coordinates})
+    if shard:
+        settings['shard'] = '%d/%d' % shard
+    fieldnames = csv_headings(RestrictionScanner(params['enzymes']), hits=args.genome is not None,
+                              coordinates=args.coordinates)
+    # a run can't be resumed if its output is missing or was made with other settings
+    try:
+        writer = open_writer(csvfilename, fieldnames, settings, resume=args.resume is not None, fmt=args.format)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    # read the records straight out of the memory mapped fasta file, which is indexed (in <input>.fai) on the first run
+    # 'Whole Chromosome CDS list 1000bp.fasta' 'Test_Genes.fasta'
+    fasta = FastaFile(str(args.input))
+
+    # Records already written by an interrupted run are skipped, as are those of other shards (which are never read).
+    # The index and ID of every record sent off to be designed are queued, so that they can be matched up with the rows
+    # coming back in the same order.
+    queued = collections.deque()
+    def records():
+        for index, ID, SEQ in fasta.select(lambda ID: shard is None or shard_of(ID, shard[1]) == shard[0]):
+            if not writer.is_done(index, ID):
+                queued.append((index, ID))
+                yield ID, SEQ
+
+    with profile(args.profile), writer:
+        for pairs in design_flanking_records(records(), params):
+            index, ID = queued.popleft()
+            writer.write_record(index, ID, [pair.row(args.coordinates) for pair in pairs])
+
+    # the metrics sidecar files go next to the .csv, as <csv name>.metrics.json and <csv name>.metrics.csv
+    if args.metrics:
+        stem = csvfilename[:-len(formats[args.format])] if csvfilename.endswith(formats[args.format]) else \
+            os.path.splitext(csvfilename)[0]
+        params['metrics'].write(stem + '.metrics')
+
+    if args.cache:
+        # close the cache of this process too, which designed the records if there were no workers, to count its hits
+        open_cache(None)
+        cache_after = cache.stats()
+        hits = cache_after['hits'] - cache_before['hits']
+        misses = cache_after['misses'] - cache_before['misses']
+        print('Primer3 cache: %d hits, %d misses, %.1f MB stored' % (hits, misses, cache_after['bytes'] / 1024 ** 2))
+        cache.close()
@@ -2,53 +2,78 @@ __author__ = 'Joshua Ball (joshua.ball@earlham.ac.uk)'
 __version__ = '1.0.2'
 
 import argparse
-import primer3
-from Bio import SeqIO
+import collections
 import csv
+import functools
+import os
+import sys
 from datetime import datetime
 from PrimerFilters import *
+from PrimerCache import DesignCache, design_primers, open_cache
+from PrimerCandidates import CandidateSet
+from PrimerFasta import FastaFile
+from PrimerMetrics import MeasuredDesign, MetricsCollector, profile
+from PrimerOutput import formats, open_writer
+from PrimerParallel import ordered_map
+from PrimerRecords import csv_headings, primer_pairs
+from PrimerShards import parse_shard, shard_of
 
-# argument parser for command line
-parser = argparse.ArgumentParser(description='Primer Designer')
-parser.add_argument('-i', '--input', help='Input file name', required=True)
-parser.add_argument('-n', '--number', help='Number of Primer pairs to return', default=5)
-parser.add_argument('-l', '--lower', help='Min Primer Product Length', default=200)
-parser.add_argument('-u', '--upper', help='Max Primer Product Length', default=500)
-args = parser.parse_args()
-
-# create the .csv file and enter headers. Also assign date and time stamped names for CSV and TXT files to be made.
-csvfilename = 'Primers '+datetime.today().strftime('%y-%m-%d %H.%M.%S')+'.csv'
-headings = ['Gene', 'Primer', 'Flank', 'Pair Penalty', 'Left Penalty', 'Right Penalty',
-            'Primer Forward', 'Primer Reverse', 'Left (Start, Length)', 'Right (Start, Length)', 'Left TM', 'Right TM',
-            'Left GC%', 'Right GC%', 'Left Self Any TH', 'Right Self Any TH', 'Left Self End TH', 'Right Self End TH',
-            'Left Hairpin TH', 'Right Hairpin TH', 'Left End Stability', 'Right End Stability', 'Pair Compl Any TH',
-            'Pair Compl End TH', 'Pair Product Size', 'bsaI in Product', 'bsaI Start', 'bsmbI in Product',
-            'bsmbI Start', 'bspqI in Product', 'bspqI Start', 'btgzI in Product', 'btgzI Start',
-            'Primer Product Sequence']
-with open(csvfilename, 'w') as f:
-    writer = csv.DictWriter(f, fieldnames=headings)
-    writer.writeheader()
-    f.close()
-
-# using BioPython to get info from fasta file.
-# 'Whole Chromosome CDS list 1000bp.fasta' 'Test_fastas/Test_Genes.fasta'
-myfast = SeqIO.parse(str(args.input), 'fasta')
-for seq_record in myfast:
-    ID = seq_record.id
-    SEQ = str(seq_record.seq)
-    CDS_len = sum(1 for c in SEQ if c.isupper())
-    CDS_start = SEQ.find(find_CDS_start(SEQ))
+# the shortest primer primer3 is asked for (PRIMER_MIN_SIZE). The k-mers looked up in a genome can't be longer.
+min_primer_size = 18
+
+
+# function to call primer3 on only SEQUENCE_TEMPLATE[start:end]. The target and excluded regions are given as [start,
+# length] in the coordinates of the whole template and are moved into the window (excluded regions outside of it are
+# dropped), then the primer positions in the results are moved back so they still refer to the whole template. Every
+# product the window is for lies within it, so a window shorter than the smallest product size can't give any pairs,
+# and no pairs are returned for it without calling primer3 (which rejects templates that short).
+def design_window(seq_args, global_args, start, end):
+    if end - start < global_args['PRIMER_PRODUCT_SIZE_RANGE'][0]:
+        return {'PRIMER_LEFT_NUM_RETURNED': 0, 'PRIMER_RIGHT_NUM_RETURNED': 0, 'PRIMER_INTERNAL_NUM_RETURNED': 0,
+                'PRIMER_PAIR_NUM_RETURNED': 0}
+    window_args = dict(seq_args)
+    window_args['SEQUENCE_TEMPLATE'] = seq_args['SEQUENCE_TEMPLATE'][start:end]
+    window_args['SEQUENCE_TARGET'] = [seq_args['SEQUENCE_TARGET'][0] - start, seq_args['SEQUENCE_TARGET'][1]]
+    excluded = []
+    for region_start, region_len in seq_args.get('SEQUENCE_EXCLUDED_REGION', []):
+        region_start, region_end = max(region_start, start), min(region_start + region_len, end)
+        if region_start < region_end:
+            excluded.append([region_start - start, region_end - region_start])
+    # an empty list rather than no key, as primer3-py otherwise keeps the excluded regions of the previous call
+    window_args['SEQUENCE_EXCLUDED_REGION'] = excluded
+
+    results = design_primers(window_args, global_args)
+    for index in range(results['PRIMER_PAIR_NUM_RETURNED']):
+        for key in ['PRIMER_LEFT_%d' % index, 'PRIMER_RIGHT_%d' % index]:
+            results[key] = type(results[key])([results[key][0] + start, results[key][1]])
+    return results
+
+
+# function to return the RecordLayout of a record for designing its flank primers (see RecordLayout). A record with
+# no bases before or after its CDS also can't be designed for, as no primer can go outside the CDS on that side and
+# primer3 rejects a right flank target that runs past the end of the template.
+def flank_layout(SEQ, lower):
+    layout = RecordLayout(SEQ, lower)
+    if layout.cds_len and not layout.left_flank:
+        layout.problems.append('no left flank')
+    if layout.cds_len and not layout.right_flank:
+        layout.problems.append('no right flank')
+    return layout
+
+
+# function that works out the primer3 settings and the left and right flank targets and excluded regions for one fasta
+# record, from its RecordLayout, returning (global_args, left_args, right_args, left_window, right_window). Unless
+# window is False, each window is the part of the template that a product of at most upper bases around its flank's
+# target could come from.
+def flank_args(ID, SEQ, layout, num, lower, upper, window=True):
+    CDS_len = layout.cds_len
+    CDS_start = layout.cds_start
     #print(ID)
     #print(SEQ)
-    #print(find_CDS_start(SEQ))
     #print("CDS Start = ", CDS_start)
     #print("CDS Length = ", CDS_len)
 
     # Use Primer 3 and get results for Left Flanking Region.
-    num = int(args.number)  # number of primer pairs to generate.
-    lower = int(args.lower)
-    upper = int(args.upper)
-
     # To be used in the start and length for excluded regions
     exclude_start_left = CDS_start+200 # Start point for excluded Left primer region.
     # Depending on CDS length either use final position or -200 for the length element of excluded Right primer
@@ -59,235 +84,462 @@ for seq_record in myfast:
         exclude_start_right = CDS_len-200
     #print(CDS_start+(exclude_start_right))
 
-    leftprimerlist = (primer3.bindings.designPrimers(
-        {
-            'SEQUENCE_ID': ID,
-            'SEQUENCE_TEMPLATE': SEQ,
-            'SEQUENCE_EXCLUDED_REGION': [exclude_start_left, len(SEQ)-exclude_start_left],
-            'SEQUENCE_TARGET': [CDS_start, 3]
-        },
-        {
-            'PRIMER_TASK': 'generic',
-            'PRIMER_PICK_LEFT_PRIMER': 1,
-            'PRIMER_PICK_RIGHT_PRIMER': 1,
-            'PRIMER_NUM_RETURN': num,
-            'PRIMER_OPT_SIZE': 20,
-            'PRIMER_MIN_SIZE': 18,
-            'PRIMER_MAX_SIZE': 30,
-            'PRIMER_PRODUCT_SIZE_RANGE': [lower, upper],
-            'PRIMER_OPT_TM': 55,
-            'PRIMER_MIN_TM': 50,
-            'PRIMER_MAX_TM': 60,
-            'PRIMER_EXPLAIN_FLAG': 1,
-            'PRIMER_MAX_END_STABILITY': 6.0,
-            'PRIMER_MIN_GC': 44.0,
-            'PRIMER_OPT_GC_PERCENT': 50.0,
-            'PRIMER_MAX_GC': 80.0
-        }
-    ))
+    # The left primer can't start more than upper bases before the target, and the right primer can't end more than
+    # upper bases after it or inside the excluded region, so primer3 only needs to see that part of SEQ.
+    if window:
+        left_window = (max(0, CDS_start - upper), min(len(SEQ), CDS_start + 3 + upper, exclude_start_left))
+        right_window = (max(0, CDS_start + CDS_len - 2 - upper), min(len(SEQ), CDS_start + CDS_len + 1 + upper))
+    else:
+        left_window = right_window = (0, len(SEQ))
+
+    # primer3 settings, the same for both flanks
+    global_args = {
+        'PRIMER_TASK': 'generic',
+        'PRIMER_PICK_LEFT_PRIMER': 1,
+        'PRIMER_PICK_RIGHT_PRIMER': 1,
+        'PRIMER_NUM_RETURN': num,
+        'PRIMER_OPT_SIZE': 20,
+        'PRIMER_MIN_SIZE': min_primer_size,
+        'PRIMER_MAX_SIZE': 30,
+        'PRIMER_PRODUCT_SIZE_RANGE': [lower, upper],
+        'PRIMER_OPT_TM': 55,
+        'PRIMER_MIN_TM': 50,
+        'PRIMER_MAX_TM': 60,
+        'PRIMER_EXPLAIN_FLAG': 1,
+        'PRIMER_MAX_END_STABILITY': 6.0,
+        'PRIMER_MIN_GC': 44.0,
+        'PRIMER_OPT_GC_PERCENT': 50.0,
+        'PRIMER_MAX_GC': 80.0
+    }
+    left_args = {
+        'SEQUENCE_ID': ID,
+        'SEQUENCE_TEMPLATE': SEQ,
+        'SEQUENCE_EXCLUDED_REGION': [[exclude_start_left, len(SEQ)-exclude_start_left]],
+        'SEQUENCE_TARGET': [CDS_start, 3]
+    }
+    right_args = {
+        'SEQUENCE_ID': ID,
+        'SEQUENCE_TEMPLATE': SEQ,
+        'SEQUENCE_EXCLUDED_REGION': [[1, CDS_start + (exclude_start_right)]],
+        'SEQUENCE_TARGET': [(CDS_start + (CDS_len - 2)), 3]
+    }
+    return global_args, left_args, right_args, left_window, right_window
+
+
+# function to return the CandidateSet of a record for both flanks, from the parts of the left and right windows either
+# side of the targets that are not in the hopeless regions found by the prescreen
+def flank_candidates(ID, SEQ, global_args, left_args, right_args, left_window, right_window, hopeless=()):
+    left_target, right_target = left_args['SEQUENCE_TARGET'][0], right_args['SEQUENCE_TARGET'][0]
+    left_regions = [(left_window[0], left_target), (right_window[0], right_target)]
+    right_regions = [(left_target + 3, left_window[1]), (right_target + 3, right_window[1])]
+    if hopeless:
+        from PrimerPrescreen import outside
+        left_regions = outside(left_regions, hopeless)
+        right_regions = outside(right_regions, hopeless)
+    return CandidateSet(ID, SEQ, global_args, left_regions, right_regions)
+
+
+# function to add the parts of each window that no oligo within primer3's GC and Tm limits could overlap (see
+# PrimerPrescreen) to the excluded regions of its flank, returning them all. Only imported here as it needs numpy. The
+# hopeless regions are found separately for each window, as that is all of SEQ primer3 sees (and only so many excluded
+# regions can be given).
+def exclude_hopeless(SEQ, global_args, left_args, right_args, left_window, right_window):
+    from PrimerPrescreen import hopeless_regions
+    left_hopeless = hopeless_regions(SEQ, global_args, *left_window)
+    right_hopeless = hopeless_regions(SEQ, global_args, *right_window)
+    left_args['SEQUENCE_EXCLUDED_REGION'] = left_args['SEQUENCE_EXCLUDED_REGION'] + left_hopeless
+    right_args['SEQUENCE_EXCLUDED_REGION'] = right_args['SEQUENCE_EXCLUDED_REGION'] + right_hopeless
+    return left_hopeless + right_hopeless
+
+
+# function that designs the left and right flank primers for one fasta record, given as an (ID, sequence) tuple, and
+# returns them as a list of PrimerPairs. Kept at module level so that it can be sent to worker processes. Unless window
+# is False, each primer3 call is only given the part of the template that a product of at most upper bases around its
+# target could come from, which gives the same primers much faster when the flanks or the CDS are long. With shared,
+# the oligos are scored once for both flanks (see PrimerCandidates.CandidateSet), again giving the same primers. With
+# prescreen, the parts of each window that no oligo within primer3's GC and Tm limits could overlap are excluded before
+# primer3 is called (see PrimerPrescreen), which also gives the same primers. Records that primers can't be designed
+# for (see flank_layout) are skipped with a message, giving no pairs.
+def design_record(record, num, lower, upper, scanner, window=True, shared=False, prescreen=False):
+    ID, SEQ = record
+    layout = flank_layout(SEQ, lower)
+    if layout.problems:
+        print('Skipping %s: %s' % (ID, ', '.join(layout.problems)), file=sys.stderr)
+        return []
+    global_args, left_args, right_args, left_window, right_window = flank_args(ID, SEQ, layout, num, lower, upper,
+                                                                               window)
+    hopeless = []
+    if prescreen:
+        hopeless = exclude_hopeless(SEQ, global_args, left_args, right_args, left_window, right_window)
+
+    # With shared, the candidate oligos for both flanks are found and scored by one primer3 call and then paired for
+    # each flank, rather than running a full design for each flank.
+    if shared:
+        candidates = flank_candidates(ID, SEQ, global_args, left_args, right_args, left_window, right_window, hopeless)
+        leftprimerlist = candidates.pairs(left_args['SEQUENCE_TARGET'], left_args['SEQUENCE_EXCLUDED_REGION'], num)
+        rightprimerlist = candidates.pairs(right_args['SEQUENCE_TARGET'], right_args['SEQUENCE_EXCLUDED_REGION'], num)
+    else:
+        leftprimerlist = design_window(left_args, global_args, *left_window)
+        rightprimerlist = design_window(right_args, global_args, *right_window)
     #print(leftprimerlist)
     # leftprimerlist is the initial output of primer3
 
-    leftnewlist = cleanupdata(leftprimerlist)
-    # print(leftnewlist)
-    # leftnewlist is a filtered version of leftprimerlist, number of primers returned and explains have been removed
-
-    # Separate the data based on the primer number in each key! This results in a dictionary of sub-dictionaries where a
-    # sub-dictionary is a primer pair
-    reg = re.compile(r'\d+')  # regex that finds the number (primer number) in the keys (e.g. PRIMER_PAIR_0_PENALTY)
-    leftsplitprimers = {}  # This will be the dictionary that all sub-dictionaries go into
-    for k, v in leftnewlist.items():
-        m = reg.search(k)
-        if m:
-            numb = m.group()
-            leftsplitprimers.setdefault(numb, {})[k] = v
-        else:
-            print('Invalid key:', k, v)
-
-    # print(leftsplitprimers)
-
-    # This adds 2 new keys and values to each primer-pair dictionary. 1 for the Primer pair number, and 1 for the Gene ID
-    # This also then turns the dictionary of sub-dictionaries into a LIST of dictionaries called primers, this is important
-    # for further steps.
-
-    leftprimers = []
-    for j in leftsplitprimers:
-        leftsplitprimers[j]['Primer'] = str(int(j) + 1)
-        leftsplitprimers[j]['Gene'] = ID
-        leftsplitprimers[j]['Flank'] = 'Left'
-        leftprimers.append(leftsplitprimers[j])
-
-    # print(leftprimers)
-
-    # Check for bsaI, and other enzymes, and filter primers and append key and value of 'Yes' or 'No' this also checks
-    # for start position of the enzymes and includes this as well as including the full theoretical product sequence
-    leftfprimers = []
-    check = re.compile(r'PRIMER_LEFT_\d+$')
-    check2 = re.compile(r'PRIMER_RIGHT_\d+$')
-    for i in leftprimers:
-        for j in i:
-            if check.search(j):
-                leftprimerstart = i[j][0]
-            elif check2.search(j):
-                leftprimerend = i[j][0] + 1
-            else:
-                pass
-        leftprimer = SEQ[leftprimerstart:leftprimerend]
-        if bsa_in_primer(leftprimer):
-            i['bsaI in Product'] = 'Yes'
-            result = re.search(r'ggtctc', leftprimer) or re.search(r'gagacc', leftprimer)
-            i['bsaI Start'] = result.start()
-            i['Primer Product'] = leftprimer
-            leftfprimers.append(i)
-        else:
-            i['bsaI in Product'] = 'No'
-            i['bsaI Start'] = 'n/a'
-            i['Primer Product'] = leftprimer
-            leftfprimers.append(i)
-
-        if bsmbI_in_primer(leftprimer):
-            i['bsmbI in Product'] = 'Yes'
-            r1 = re.search(r'cgtctc', leftprimer) or re.search(r'gagacg', leftprimer)
-            i['bsmbI Start'] = r1.start()
-        else:
-            i['bsmbI in Product'] = 'No'
-            i['bsmbI Start'] = 'n/a'
+    # Turn each primer3 result into PrimerPairs, then check the theoretical product of each pair for bsaI and the other
+    # enzymes on both strands and in either case.
+    return (primer_pairs(leftprimerlist, ID, 'Left', SEQ, scanner) +
+            primer_pairs(rightprimerlist, ID, 'Right', SEQ, scanner))
 
-        if bspqI_in_primer(leftprimer):
-            i['bspqI in Product'] = 'Yes'
-            r2 = re.search(r'gctcttc', leftprimer) or re.search(r'gaagagc', leftprimer)
-            i['bspqI Start'] = r2.start()
-        else:
-            i['bspqI in Product'] = 'No'
-            i['bspqI Start'] = 'n/a'
 
-        if btgzI_in_primer(leftprimer):
-            i['btgzI in Product'] = 'Yes'
-            r3 = re.search(r'gcgatg', leftprimer) or re.search(r'catcgc', leftprimer)
-            i['btgzI Start'] = r3.start()
-        else:
-            i['btgzI in Product'] = 'No'
-            i['btgzI Start'] = 'n/a'
-
-    # print(leftfprimers)
-
-    leftfprimers = replacekey(leftfprimers)
-    # print(leftfprimers)
-
-    # Repeat the same process for the Right Flanking Region
-    rightprimerlist = (primer3.bindings.designPrimers(
-        {
-            'SEQUENCE_ID': ID,
-            'SEQUENCE_TEMPLATE': SEQ,
-            'SEQUENCE_EXCLUDED_REGION': [1, CDS_start + (exclude_start_right)],
-            'SEQUENCE_TARGET': [(CDS_start + (CDS_len - 2)), 3]
-        },
-        {
-            'PRIMER_TASK': 'generic',
-            'PRIMER_PICK_LEFT_PRIMER': 1,
-            'PRIMER_PICK_RIGHT_PRIMER': 1,
-            'PRIMER_NUM_RETURN': num,
-            'PRIMER_OPT_SIZE': 20,
-            'PRIMER_MIN_SIZE': 18,
-            'PRIMER_MAX_SIZE': 30,
-            'PRIMER_PRODUCT_SIZE_RANGE': [lower, upper],
-            'PRIMER_OPT_TM': 55,
-            'PRIMER_MIN_TM': 50,
-            'PRIMER_MAX_TM': 60,
-            'PRIMER_EXPLAIN_FLAG': 1,
-            'PRIMER_MAX_END_STABILITY': 6.0,
-            'PRIMER_MIN_GC': 44.0,
-            'PRIMER_OPT_GC_PERCENT': 50.0,
-            'PRIMER_MAX_GC': 80.0
-        }
-    ))
-    # print(rightprimerlist)
-
-    rightnewlist = cleanupdata(rightprimerlist)
-    # print(rightnewlist)
-
-    reg = re.compile(r'\d+')
-    rightsplitprimers = {}
-    for k, v in rightnewlist.items():
-        m = reg.search(k)
-        if m:
-            numb = m.group()
-            rightsplitprimers.setdefault(numb, {})[k] = v
-        else:
-            print('Invalid key:', k, v)
-
-    # print(rightsplitprimers)
-
-    rightprimers = []
-    for j in rightsplitprimers:
-        rightsplitprimers[j]['Primer'] = str(int(j) + 1)
-        rightsplitprimers[j]['Gene'] = ID
-        rightsplitprimers[j]['Flank'] = 'Right'
-        rightprimers.append(rightsplitprimers[j])
-
-    # print(rightprimers)
-
-    rightfprimers = []
-    check = re.compile(r'PRIMER_LEFT_\d+$')
-    check2 = re.compile(r'PRIMER_RIGHT_\d+$')
-    for i in rightprimers:
-        for j in i:
-            if check.search(j):
-                rightprimerstart = i[j][0]
-            elif check2.search(j):
-                rightprimerend = i[j][0] + 1
-            else:
-                pass
-        rightprimer = SEQ[rightprimerstart:rightprimerend]
-        if bsa_in_primer(rightprimer):
-            i['bsaI in Product'] = 'Yes'
-            result = re.search(r'ggtctc', rightprimer) or re.search(r'gagacc', rightprimer)
-            i['bsaI Start'] = result.start()
-            i['Primer Product'] = rightprimer
-            rightfprimers.append(i)
-        else:
-            i['bsaI in Product'] = 'No'
-            i['bsaI Start'] = 'n/a'
-            i['Primer Product'] = rightprimer
-            rightfprimers.append(i)
-
-        if bsmbI_in_primer(rightprimer):
-            i['bsmbI in Product'] = 'Yes'
-            r1 = re.search(r'cgtctc', rightprimer) or re.search(r'gagacg', rightprimer)
-            i['bsmbI Start'] = r1.start()
-        else:
-            i['bsmbI in Product'] = 'No'
-            i['bsmbI Start'] = 'n/a'
+# function that designs the primers of one fasta record for every (lower, upper, num) setting in grid, returning a list
+# of PrimerPairs for each setting in the same order. The record's targets, windows (wide enough for the largest upper)
+# and prescreen are only worked out once, its candidate oligos are found and scored once in one CandidateSet and then
+# paired for each product size range, checking each oligo and pair at most once for the whole grid. Each range is
+# paired for the largest num asked for with it, and the smaller nums take its best pairs, as pairs are picked best
+# first. Each setting gets the same primers as a design with -s and those settings.
+def sweep_record(record, grid, scanner, prescreen=False):
+    ID, SEQ = record
+    lower, upper = min(setting[0] for setting in grid), max(setting[1] for setting in grid)
+    layout = flank_layout(SEQ, lower)
+    if layout.problems:
+        print('Skipping %s: %s' % (ID, ', '.join(layout.problems)), file=sys.stderr)
+        return [[] for setting in grid]
+    num = max(setting[2] for setting in grid)
+    global_args, left_args, right_args, left_window, right_window = flank_args(ID, SEQ, layout, num, lower, upper)
+    hopeless = []
+    if prescreen:
+        hopeless = exclude_hopeless(SEQ, global_args, left_args, right_args, left_window, right_window)
+    candidates = flank_candidates(ID, SEQ, global_args, left_args, right_args, left_window, right_window, hopeless)
+
+    flanks = {}  # (lower, upper) -> (left PrimerPairs, right PrimerPairs)
+    for lower, upper, num in sorted(grid, key=lambda setting: -setting[2]):
+        if (lower, upper) not in flanks:
+            flanks[(lower, upper)] = [
+                primer_pairs(candidates.pairs(args['SEQUENCE_TARGET'], args['SEQUENCE_EXCLUDED_REGION'], num,
+                                              (lower, upper)), ID, flank, SEQ, scanner)
+                for args, flank in [(left_args, 'Left'), (right_args, 'Right')]]
+    return [flanks[(lower, upper)][0][:num] + flanks[(lower, upper)][1][:num] for lower, upper, num in grid]
 
-        if bspqI_in_primer(rightprimer):
-            i['bspqI in Product'] = 'Yes'
-            r2 = re.search(r'gctcttc', rightprimer) or re.search(r'gaagagc', rightprimer)
-            i['bspqI Start'] = r2.start()
+
+# function to lay a chain of overlapping amplicons across the CDS of a RecordLayout, returning the primer3 style results
+# of each amplicon's pair and the (first, last) parts of the CDS the chain leaves out. design(start, end) is called for
+# the best pair whose left primer ends by base start and whose right primer starts after base end. The part of the
+# template between the primers of each amplicon overlaps that of the one before by at least overlap bases, the first
+# starts before the CDS and the last ends after it. Each amplicon is made to cover as much more of the CDS as it can,
+# trying to cover three quarters, half and then a quarter as much when no pair fits. Where no pair carries the chain on
+# by a quarter, it starts again further along. overlap must be less than lower, so that every amplicon can carry the
+# chain on.
+def tile_chain(layout, lower, upper, min_size, overlap, design):
+    if overlap >= lower:
+        raise ValueError('The overlap (%d) must be less than the smallest product size (%d)' % (overlap, lower))
+    longest = max(1, upper - 2 * min_size - overlap)  # the most of the CDS that one more amplicon could cover
+    tiles = []
+    gaps = []
+    covered = layout.cds_start - 1  # the last base of the CDS covered by the amplicons so far
+    reach = covered  # the last base tried, which is past covered once the chain has to start again
+    while reach < layout.cds_end - 1:
+        start = covered - overlap if tiles and reach == covered else reach
+        for advance in sorted({max(1, longest * quarters // 4) for quarters in [4, 3, 2, 1]}, reverse=True):
+            end = min(layout.cds_end - 1, reach + advance)
+            results = design(start, end)
+            if results['PRIMER_PAIR_NUM_RETURNED']:
+                break
         else:
-            i['bspqI in Product'] = 'No'
-            i['bspqI Start'] = 'n/a'
+            reach = end
+            continue
+        left_last = results['PRIMER_LEFT_0'][0] + results['PRIMER_LEFT_0'][1] - 1
+        if left_last > covered:
+            gaps.append((covered + 1, left_last))
+        covered = reach = results['PRIMER_RIGHT_0'][0] - results['PRIMER_RIGHT_0'][1]
+        tiles.append(results)
+    if covered < layout.cds_end - 1:
+        gaps.append((covered + 1, layout.cds_end - 1))
+    return tiles, gaps
+
+
+# function that tiles the CDS of one fasta record with a chain of overlapping amplicons (see tile_chain) of lower to
+# upper bases, for checking the whole CDS by sequencing, returning the best pair of each as a PrimerPair with 'Tile 1',
+# 'Tile 2', ... as its flank. Each amplicon is designed by primer3 with only the part of the template its primers could
+# come from, so the time grows in line with the length of the CDS. Nothing is reused between the amplicons. With shared,
+# the candidate oligos of the CDS and upper bases either side of it are instead found and scored once, in one
+# CandidateSet, and each amplicon is paired from just the oligos near it (CandidateSet.near), giving the same primers.
+# Scoring every oligo of the whole span makes that about ten times slower (see benchmarks/bench_tile.py), so it is not
+# the default. Ends of the span too short for a primer give no candidates (see CandidateSet). With prescreen, the parts
+# of the template no oligo could overlap are found once for the whole record and excluded from every amplicon. Any parts
+# of the CDS that no amplicon could cover are printed. Records that primers can't be designed for are skipped.
+def tile_record(record, lower, upper, scanner, overlap=50, shared=False, prescreen=False):
+    ID, SEQ = record
+    layout = RecordLayout(SEQ, lower)
+    if layout.problems:
+        print('Skipping %s: %s' % (ID, ', '.join(layout.problems)), file=sys.stderr)
+        return []
+    global_args = flank_args(ID, SEQ, layout, 1, lower, upper)[0]
+    span = (max(0, layout.cds_start - upper), min(len(SEQ), layout.cds_end + upper))
+    hopeless = []
+    if prescreen:
+        from PrimerPrescreen import hopeless_regions
+        hopeless = hopeless_regions(SEQ, global_args, *span)
 
-        if btgzI_in_primer(rightprimer):
-            i['btgzI in Product'] = 'Yes'
-            r3 = re.search(r'gcgatg', rightprimer) or re.search(r'catcgc', rightprimer)
-            i['btgzI Start'] = r3.start()
+    # the product can be at most upper bases, which limits how far from the amplicon each primer can be
+    if shared:
+        regions = [span]
+        if hopeless:
+            from PrimerPrescreen import outside
+            regions = outside(regions, hopeless)
+        candidates = CandidateSet(ID, SEQ, global_args, regions, regions)
+
+        def design(start, end):
+            lefts = [oligo for oligo in candidates.near('LEFT', end - upper + 2, start) if oligo.last <= start]
+            return candidates.pick(lefts, candidates.near('RIGHT', end + 1, start + upper - 1), 1, (lower, upper))
+    else:
+        def design(start, end):
+            seq_args = {'SEQUENCE_ID': ID, 'SEQUENCE_TEMPLATE': SEQ, 'SEQUENCE_TARGET': [start + 1, end - start],
+                        'SEQUENCE_EXCLUDED_REGION': hopeless}
+            return design_window(seq_args, global_args, max(span[0], end - upper + 2), min(span[1], start + upper))
+
+    tiles, gaps = tile_chain(layout, lower, upper, global_args['PRIMER_MIN_SIZE'], overlap, design)
+    if gaps:
+        print('Tiling %s: bases %s of the template could not be covered' %
+              (ID, ', '.join('%d-%d' % gap for gap in gaps)), file=sys.stderr)
+    return [pair for n, results in enumerate(tiles) for pair in primer_pairs(results, ID, 'Tile %d' % (n + 1), SEQ,
+                                                                            scanner)]
+
+
+# default settings for design_full, the same as the command line defaults. enzymes is a dictionary of restriction
+# enzyme names and recognition sites, cache a directory to cache primer3 results in (or None) and cache_size its max
+# size in MB. metrics can be a PrimerMetrics.MetricsCollector to add the timings of each record to. If genome is a
+# FASTA file, the 3' end (the last kmer bases, with up to mismatches mismatches) of each primer is looked up in it and
+# pairs with a primer binding more than max_hits places are dropped (see PrimerSpecificity). prescreen excludes the
+# parts of the templates that can't hold a primer within primer3's GC and Tm limits before primer3 is called. tile
+# designs a chain of amplicons overlapping by at least overlap bases across each CDS instead of the flank primers (see
+# tile_record), with one pair for each, so number is not used.
+default_params = {'number': 5, 'lower': 200, 'upper': 500, 'enzymes': default_enzymes, 'shared': False,
+                  'prescreen': False, 'tile': False, 'overlap': 50, 'workers': 1, 'cache': None, 'cache_size': 1024,
+                  'metrics': None, 'genome': None, 'kmer': 15, 'mismatches': 1, 'max_hits': None}
+
+
+# function to return design_record with the settings in params filled in, which can be sent to worker processes
+def record_design(params):
+    if params['tile']:
+        return functools.partial(tile_record, lower=params['lower'], upper=params['upper'],
+                                 scanner=RestrictionScanner(params['enzymes']), overlap=params['overlap'],
+                                 shared=params['shared'], prescreen=params['prescreen'])
+    return functools.partial(design_record, num=params['number'], lower=params['lower'], upper=params['upper'],
+                             scanner=RestrictionScanner(params['enzymes']),
+                             shared=params['shared'], prescreen=params['prescreen'])
+
+
+# function to check that the k-mer looked up in the genome (if there is one) is no longer than the shortest primer, so
+# that a run doesn't stop part way through when a short primer can't be looked up
+def check_kmer(params):
+    if params['genome'] is not None and params['kmer'] > min_primer_size:
+        raise ValueError('The k-mer length (%d) must be at most the shortest primer length (%d)'
+                         % (params['kmer'], min_primer_size))
+
+
+# function to design the primers for an iterable of (ID, sequence) records, yielding the list of PrimerPairs of each
+# record in the same order as the records. params only needs the settings that differ from default_params. Records are
+# read and designed lazily, so this can be used on a genome sized input or called again for each small job.
+def design_full_records(records, params=None):
+    params = dict(default_params, **(params or {}))
+    check_kmer(params)
+    design = record_design(params)
+    initargs = (params['cache'], params['cache_size'] * 1024 ** 2)
+    # Records are designed in parallel when workers > 1, but still come back in input order.
+    if params['metrics'] is None:
+        designed = ordered_map(design, records, params['workers'], initializer=open_cache, initargs=initargs)
+    else:
+        designed = params['metrics'].collect(ordered_map(MeasuredDesign(design), records, params['workers'],
+                                                         initializer=open_cache, initargs=initargs))
+    if params['genome'] is None:
+        yield from designed
+        return
+
+    # Only imported here as it needs numpy. The primers are checked in this process, so the index is opened just once.
+    from PrimerSpecificity import KmerIndex, check_pairs
+    index = KmerIndex(params['genome'], params['kmer'])
+    for pairs in designed:
+        yield check_pairs(index, pairs, params['mismatches'], max_hits=params['max_hits'])
+
+
+# function to design the primers for an iterable of (ID, sequence) records for every (lower, upper, num) setting in grid
+# (see sweep_record), yielding a list with the PrimerPairs of each setting for each record, in the same order as the
+# records. number, lower, upper, shared and metrics in params are not used.
+def sweep_full_records(records, grid, params=None):
+    params = dict(default_params, **(params or {}))
+    check_kmer(params)
+    sweep = functools.partial(sweep_record, grid=grid, scanner=RestrictionScanner(params['enzymes']),
+                              prescreen=params['prescreen'])
+    initargs = (params['cache'], params['cache_size'] * 1024 ** 2)
+    designed = ordered_map(sweep, records, params['workers'], initializer=open_cache, initargs=initargs)
+    if params['genome'] is None:
+        yield from designed
+        return
+
+    # Only imported here as it needs numpy
+    from PrimerSpecificity import KmerIndex, check_pairs
+    index = KmerIndex(params['genome'], params['kmer'])
+    for settings in designed:
+        yield [check_pairs(index, pairs, params['mismatches'], max_hits=params['max_hits']) for pairs in settings]
+
+
+# function to design the primers for an iterable of (ID, sequence) records, yielding every PrimerPair in turn
+def design_full(records, params=None):
+    for pairs in design_full_records(records, params):
+        yield from pairs
+
+
+if __name__ == '__main__':
+    # argument parser for command line
+    parser = argparse.ArgumentParser(description='Primer Designer')
+    parser.add_argument('-i', '--input', help='Input file name', required=True)
+    parser.add_argument('-n', '--number', help='Number of Primer pairs to return', default=5)
+    parser.add_argument('-l', '--lower', help='Min Primer Product Length', default=200)
+    parser.add_argument('-u', '--upper', help='Max Primer Product Length', default=500)
+    parser.add_argument('-w', '--workers', help='Number of worker processes to design primers with', default=1)
+    parser.add_argument('-c', '--cache', help='Directory to cache Primer3 results in between runs', default=None)
+    parser.add_argument('--cache-size', help='Max size of the Primer3 result cache in MB', default=1024)
+    parser.add_argument('-e', '--enzymes', help='Table of restriction enzyme names and sites to look for', default=None)
+    parser.add_argument('-r', '--resume', help='.csv file of an interrupted run to carry on with', default=None)
+    parser.add_argument('--shard', help='Only design the records in shard i of N (given as i/N), by a hash of their ID',
+                        default=None)
+    parser.add_argument('-f', '--format', help='Output format (parquet falls back to npz without pyarrow)',
+                        choices=list(formats), default='csv')
+    parser.add_argument('--coordinates', help='Write the start and end of each product instead of its sequence',
+                        action='store_true')
+    parser.add_argument('-s', '--shared', help='Score candidate primers once for both flanks and pair them in Python',
+                        action='store_true')
+    parser.add_argument('--prescreen', help='Exclude regions no primer could pass the GC and Tm limits in beforehand',
+                        action='store_true')
+    parser.add_argument('-t', '--tile', help='Tile each CDS with overlapping amplicons instead of the flank primers',
+                        action='store_true')
+    parser.add_argument('--overlap', help='Min overlap in bases between neighbouring tiled amplicons', default=50)
+    parser.add_argument('-m', '--metrics', help='Write timings of each gene and primer3 call next to the .csv',
+                        action='store_true')
+    parser.add_argument('--profile', help='File to write cProfile stats of the run to', default=None)
+    parser.add_argument('--sweep', help='Product size ranges (e.g. 200-500 300-600) to design for in one run',
+                        nargs='+', default=None)
+    parser.add_argument('--sweep-number', help='Numbers of primer pairs to return in a sweep (default -n)', nargs='+',
+                        default=None)
+    parser.add_argument('-g', '--genome', help='Genome FASTA file to look up where the primers bind in', default=None)
+    parser.add_argument('--kmer', help="Number of bases at the primers' 3' end to look up in the genome", default=15)
+    parser.add_argument('--mismatches', help="Mismatches allowed in the 3' end looked up (not in its last 3 bases)",
+                        default=1)
+    parser.add_argument('--max-hits', help='Drop pairs with a primer binding more places than this in the genome',
+                        default=None)
+    args = parser.parse_args()
+    shard = parse_shard(args.shard) if args.shard else None
+    if args.genome and int(args.kmer) > min_primer_size:
+        parser.error('--kmer must be at most %d, the shortest primer length' % min_primer_size)
+    if args.sweep and args.metrics:
+        parser.error('-m can not be used with --sweep')
+    if args.sweep and args.tile:
+        parser.error('--tile can not be used with --sweep')
+    if args.tile and int(args.overlap) >= int(args.lower):
+        parser.error('--overlap must be less than -l')
+
+    params = {'number': int(args.number), 'lower': int(args.lower), 'upper': int(args.upper),
+              'enzymes': load_enzymes(args.enzymes) if args.enzymes else default_enzymes, 'shared': args.shared,
+              'prescreen': args.prescreen, 'tile': args.tile, 'overlap': int(args.overlap),
+              'workers': int(args.workers), 'cache': args.cache, 'cache_size': int(args.cache_size),
+              'metrics': MetricsCollector() if args.metrics else None, 'genome': args.genome,
+              'kmer': int(args.kmer), 'mismatches': int(args.mismatches),
+              'max_hits': int(args.max_hits) if args.max_hits is not None else None}
+    if args.cache:
+        cache = DesignCache(args.cache, params['cache_size'] * 1024 ** 2)
+        cache_before = cache.stats()
+
+    # create the .csv file and enter headers, or pick up the .csv of an interrupted run. Also assign date and time
+    # stamped names for CSV and TXT files to be made.
+    if args.resume:
+        csvfilename = args.resume
+    else:
+        csvfilename = 'Primers '+datetime.today().strftime('%y-%m-%d %H.%M.%S')+formats[args.format]
+        if shard:
+            csvfilename = csvfilename[:-len(formats[args.format])] + ' shard %d of %d' % shard + formats[args.format]
+    settings = {key: params[key] for key in ['number', 'lower', 'upper', 'enzymes']}
+    if args.tile:
+        settings.update({key: params[key] for key in ['tile', 'overlap']})
+    if args.genome:
+        settings.update({key: params[key] for key in ['genome', 'kmer', 'mismatches', 'max_hits']})
+    if args.format != 'csv' or args.coordinates:
+        settings.update({'format': args.format, 'coordinates': args.coordinates})
+    if shard:
+        settings['shard'] = '%d/%d' % shard
+    fieldnames = csv_headings(RestrictionScanner(params['enzymes']), hits=args.genome is not None,
+                              coordinates=args.coordinates)
+    # a sweep designs every product size range with every number of pairs, each setting labelled by a 'Parameter Set'
+    # column in front of its rows
+    if args.sweep:
+        grid = [[int(size) for size in product_range.split('-')] + [int(number)] for product_range in args.sweep
+                for number in (args.sweep_number or [args.number])]
+        labels = ['%d-%d n%d' % tuple(setting) for setting in grid]
+        settings['sweep'] = grid
+        fieldnames = ['Parameter Set'] + fieldnames
+    # a run can't be resumed if its output is missing or was made with other settings
+    try:
+        writer = open_writer(csvfilename, fieldnames, settings, resume=args.resume is not None, fmt=args.format)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    stem = csvfilename[:-len(formats[args.format])] if csvfilename.endswith(formats[args.format]) else \
+        os.path.splitext(csvfilename)[0]
+
+    # read the records straight out of the memory mapped fasta file, which is indexed (in <input>.fai) on the first run
+    # 'Whole Chromosome CDS list 1000bp.fasta' 'Test_fastas/Test_Genes.fasta'
+    fasta = FastaFile(str(args.input))
+
+    # Records already written by an interrupted run are skipped, as are those of other shards (which are never read).
+    # The index and ID of every record sent off to be designed are queued, so that they can be matched up with the rows
+    # coming back in the same order.
+    queued = collections.deque()
+    def records():
+        for index, ID, SEQ in fasta.select(lambda ID: shard is None or shard_of(ID, shard[1]) == shard[0]):
+            if not writer.is_done(index, ID):
+                queued.append((index, ID))
+                yield ID, SEQ
+
+    with profile(args.profile), writer:
+        if args.sweep:
+            # records designed, with left pairs, with right pairs and with both, and the sum of the best pair
+            # penalties, of each setting
+            counts = [[0, 0, 0, 0, 0.0] for setting in grid]
+            for results in sweep_full_records(records(), grid, params):
+                index, ID = queued.popleft()
+                writer.write_record(index, ID, [[label] + pair.row(args.coordinates)
+                                                for label, pairs in zip(labels, results) for pair in pairs])
+                for count, pairs in zip(counts, results):
+                    flanks = [pair.flank for pair in pairs]
+                    count[0] += 1
+                    count[1] += 'Left' in flanks
+                    count[2] += 'Right' in flanks
+                    count[3] += 'Left' in flanks and 'Right' in flanks
+                    count[4] += sum(pair.pair_penalty for pair in pairs if pair.number == 1)
         else:
-            i['btgzI in Product'] = 'No'
-            i['btgzI Start'] = 'n/a'
-
-    rightfprimers = replacekey(rightfprimers)
-    # print(rightfprimers)
-
-    # Output .txt or .csv
-    headings = ['Gene', 'Primer', 'Flank', 'Pair Penalty', 'Left Penalty',
-                'Right Penalty', 'Primer Forward', 'Primer Reverse', 'Left (Start, Length)', 'Right (Start, Length)',
-                'Left TM', 'Right TM', 'Left GC%', 'Right GC%', 'Left Self Any TH', 'Right Self Any TH',
-                'Left Self End TH', 'Right Self End TH', 'Left Hairpin TH', 'Right Hairpin TH', 'Left End Stability',
-                'Right End Stability', 'Pair Compl Any TH', 'Pair Compl End TH', 'Pair Product Size','bsaI in Product',
-                'bsaI Start', 'bsmbI in Product', 'bsmbI Start', 'bspqI in Product', 'bspqI Start', 'btgzI in Product',
-                'btgzI Start', 'Primer Product Sequence']
-    with open(csvfilename, 'a') as f:
-        writer = csv.DictWriter(f, fieldnames=headings)
-        writer.writerows(leftfprimers)
-        writer.writerows(rightfprimers)
-        f.close()
+            for pairs in design_full_records(records(), params):
+                index, ID = queued.popleft()
+                writer.write_record(index, ID, [pair.row(args.coordinates) for pair in pairs])
+
+    # the success rate of each setting of a sweep (of the records designed in this run) goes in <csv name> sweep.csv
+    if args.sweep:
+        with open(stem + ' sweep.csv', 'w', newline='') as f:
+            summary = csv.writer(f)
+            summary.writerow(['Parameter Set', 'Lower', 'Upper', 'Number', 'Records', 'Left Designed',
+                              'Right Designed', 'Both Designed', 'Success Rate (%)', 'Mean Best Pair Penalty'])
+            for label, setting, (records_done, left, right, both, penalty) in zip(labels, grid, counts):
+                rate = 100.0 * both / records_done if records_done else 0.0
+                designed = left + right
+                summary.writerow([label] + setting + [records_done, left, right, both, '%.1f' % rate,
+                                                      '%.4f' % (penalty / designed) if designed else 'n/a'])
+                print('%-16s %5.1f%% of %d records designed for both flanks' % (label, rate, records_done))
+
+    # the metrics sidecar files go next to the .csv, as <csv name>.metrics.json and <csv name>.metrics.csv
+    if args.metrics:
+        params['metrics'].write(stem + '.metrics')
+
+    if args.cache:
+        # close the cache of this process too, which designed the records if there were no workers, to count its hits
+        open_cache(None)
+        cache_after = cache.stats()
+        hits = cache_after['hits'] - cache_before['hits']
+        misses = cache_after['misses'] - cache_before['misses']
+        print('Primer3 cache: %d hits, %d misses, %.1f MB stored' % (hits, misses, cache_after['bytes'] / 1024 ** 2))
+        cache.close()
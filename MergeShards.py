@@ -0,0 +1,27 @@
+import argparse
+import re
+from PrimerShards import merge_shards
+
+
+if __name__ == '__main__':
+    # argument parser for command line
+    parser = argparse.ArgumentParser(description='Merge the outputs of a sharded primer design run')
+    parser.add_argument('-i', '--input', help='Outputs of every shard of the run (each with its .manifest)', nargs='+',
+                        required=True)
+    parser.add_argument('-o', '--output', help='File to write the merged output to (default the shard name without '
+                        '"shard i of N")', default=None)
+    parser.add_argument('--fasta', help='Input FASTA file of the run, to check every record of it is there',
+                        default=None)
+    args = parser.parse_args()
+
+    # the manifests can be given too (e.g. from "shard*"), each shard is only merged once
+    inputs = []
+    for filename in args.input:
+        filename = filename[:-len('.manifest')] if filename.endswith('.manifest') else filename
+        if filename not in inputs:
+            inputs.append(filename)
+    output = args.output or re.sub(r' shard \d+ of \d+', '', inputs[0])
+    if output in inputs:
+        parser.error('give the file to write the merged output to with -o')
+    records = merge_shards(inputs, output, args.fasta)
+    print('%d records from %d shards merged into %s' % (records, len(inputs), output))
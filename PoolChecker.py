@@ -0,0 +1,81 @@
+import argparse
+import csv
+import os
+from PrimerOutput import formats
+from PrimerPool import DimerCache, DimerMatrix, assign_pools, find_conflicts, oligo_list, overlapping_tiles, \
+    read_pairs, worst_interactions
+
+
+# function to return the gene, flank, primer number and Forward/Reverse of each oligo, for the .csv outputs
+def describe(indexed, n):
+    described = [None] * n
+    for (gene, flank), pairs in indexed.items():
+        for number, forward, reverse in pairs:
+            described[forward] = [gene, flank, number, 'Forward']
+            described[reverse] = [gene, flank, number, 'Reverse']
+    return described
+
+
+if __name__ == '__main__':
+    # argument parser for command line
+    parser = argparse.ArgumentParser(description='Primer pool checker')
+    parser.add_argument('-i', '--input', help='.csv (or .csv.gz, .jsonl or .jsonl.gz) of primers from FullDesigner or '
+                        'FlankingDesigner', required=True)
+    parser.add_argument('-s', '--parameter-set', help='Parameter Set of a --sweep output to check', default=None)
+    parser.add_argument('-a', '--all', help='Check every pair of each flank rather than only the best one',
+                        action='store_true')
+    parser.add_argument('-d', '--min-dg', help='Most stable dimer dG (kcal/mol) allowed in a pool', default=-9.0)
+    parser.add_argument('-t', '--max-tm', help='Highest dimer Tm allowed in a pool', default=None)
+    parser.add_argument('-n', '--number', help='Number of the most stable dimers to list', default=50)
+    parser.add_argument('-p', '--pools', help='Share the flanks out into pools with no conflicting dimers',
+                        action='store_true')
+    parser.add_argument('--pool-size', help='Max number of flanks in a pool', default=None)
+    parser.add_argument('-m', '--matrix', help='Also write the full dG matrix', action='store_true')
+    parser.add_argument('-w', '--workers', help='Number of worker processes to work out dimers with', default=1)
+    parser.add_argument('-c', '--cache', help='Directory to cache dimer results in between runs', default=None)
+    args = parser.parse_args()
+
+    min_dg = float(args.min_dg) * 1000  # primer3 gives dG in cal/mol
+    max_tm = float(args.max_tm) if args.max_tm is not None else None
+    extensions = [extension for extension in formats.values() if args.input.endswith(extension)]
+    prefix = (args.input[:-len(max(extensions, key=len))] if extensions else os.path.splitext(args.input)[0]) + ' pool'
+
+    units = read_pairs(args.input, args.all, args.parameter_set)
+    sequences, indexed = oligo_list(units)
+    cache = DimerCache(args.cache) if args.cache else None
+    matrix = DimerMatrix(sequences, int(args.workers), cache)
+    if cache is not None:
+        cache.close()
+    print('%d flanks, %d primers, %d dimers worked out' % (len(units), len(sequences), matrix.computed))
+    described = describe(indexed, len(sequences))
+
+    # the most stable dimers between primers of different flanks
+    with open(prefix + ' dimers.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Gene A', 'Flank A', 'Primer A', 'Oligo A', 'Sequence A', 'Gene B', 'Flank B', 'Primer B',
+                         'Oligo B', 'Sequence B', 'Dimer dG (kcal/mol)', 'Dimer TM', 'Conflict'])
+        for dg, tm, i, j in worst_interactions(matrix, indexed, int(args.number)):
+            conflict = dg < min_dg or (max_tm is not None and tm > max_tm)
+            writer.writerow(described[i] + [sequences[i]] + described[j] + [sequences[j]] +
+                            ['%.2f' % (dg / 1000), '%.2f' % tm, 'Yes' if conflict else 'No'])
+
+    if args.matrix:
+        with open(prefix + ' matrix.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            labels = ['%s %s %d %s' % tuple(described[i]) for i in range(len(sequences))]
+            writer.writerow([''] + labels)
+            for i in range(len(sequences)):
+                writer.writerow([labels[i]] + ['%.2f' % (matrix.dg(i, j) / 1000) for j in range(len(sequences))])
+
+    if args.pools:
+        conflicts = find_conflicts(matrix, indexed, min_dg, max_tm)
+        # the overlapping tiles of a gene go in different pools, as they would amplify the overlap between them
+        pools = assign_pools(indexed, conflicts, int(args.pool_size) if args.pool_size else None,
+                             overlapping_tiles(units))
+        with open(prefix + 's.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Gene', 'Flank', 'Primer', 'Pool'])
+            for pool, members in enumerate(pools):
+                for (gene, flank), number in members:
+                    writer.writerow([gene, flank, number, pool + 1])
+        print('%d pools' % len(pools))
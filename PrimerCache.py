@@ -0,0 +1,162 @@
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+import primer3
+
+# the cache used by design_primers in this process, set up by open_cache (also used as a worker pool initializer).
+_cache = None
+# list that design_primers adds the seconds taken by each call to, or None when the calls aren't timed (see time_calls)
+_call_times = None
+
+
+### CLASSES
+# On-disk cache of primer3 design_primers results. Results are stored in a SQLite database in cache_dir, keyed by a hash
+# of everything that changes the design: the template, target and excluded regions, the full global-args dict and the
+# primer3 version. SEQUENCE_ID is left out of the key so that identical templates under different gene names (paralogs,
+# duplicated entries) are only designed once. Once the stored results go over max_bytes the least recently used ones
+# are removed. The hit and miss counters are kept in the database so that the counts from every worker process of a
+# run end up in the same place.
+#
+# Looking a result up is only a read, which doesn't wait for the other processes using the cache, and the SQLite write
+# lock is only taken to store a new result (and evict old ones). The hits are counted, and their last used times kept,
+# in memory until then or until flush_every of them have been made, and are written at the same time.
+class DesignCache:
+    def __init__(self, cache_dir, max_bytes=1024 ** 3, flush_every=256):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'designs.sqlite')
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.used = {}  # key -> last used time of the hits not written to the database yet
+        self.hits = 0  # the number of those hits
+        self.conn = sqlite3.connect(self.path, timeout=600, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS designs (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                              'size INTEGER NOT NULL, last_used REAL NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS designs_last_used ON designs (last_used)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self.conn.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0), ('bytes', 0)")
+
+    # function to make the cache key for a design_primers call. primer3-py copies the sequence args of each call into
+    # the global args dict it was given, so those are left out of it, or the key would depend on the call before.
+    @staticmethod
+    def key(seq_args, global_args):
+        seq_args = {k: v for k, v in seq_args.items() if k != 'SEQUENCE_ID'}
+        global_args = {k: v for k, v in global_args.items() if not k.startswith('SEQUENCE_')}
+        text = json.dumps([primer3.__version__, seq_args, global_args], sort_keys=True, default=list)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    # function to return the cached design result for these arguments, running primer3 and storing it on a miss.
+    def design(self, seq_args, global_args):
+        key = self.key(seq_args, global_args)
+        row = self.conn.execute('SELECT value FROM designs WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self.used[key] = time.time()
+            self.hits += 1
+            if self.hits >= self.flush_every:
+                self.flush()
+            return pickle.loads(zlib.decompress(row[0]))
+
+        result = primer3.bindings.design_primers(seq_args, global_args)
+        value = zlib.compress(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self._write_hits()
+            # another process may have stored the same design in the meantime, only count the new bytes once.
+            if self.conn.execute('SELECT 1 FROM designs WHERE key = ?', (key,)).fetchone() is None:
+                self.conn.execute('INSERT INTO designs VALUES (?, ?, ?, ?)', (key, value, len(value), time.time()))
+                self.conn.execute("UPDATE stats SET value = value + ? WHERE name = 'bytes'", (len(value),))
+            self.conn.execute("UPDATE stats SET value = value + 1 WHERE name = 'misses'")
+            self._evict()
+        return result
+
+    # function to write the hits made since the last write to the database
+    def flush(self):
+        if not self.hits:
+            return
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self._write_hits()
+
+    # function to add the hits kept in memory to the hits counter and their last used times to the results. Must be
+    # called inside a transaction.
+    def _write_hits(self):
+        if not self.hits:
+            return
+        self.conn.executemany('UPDATE designs SET last_used = ? WHERE key = ?',
+                              [(used, key) for key, used in self.used.items()])
+        self.conn.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (self.hits,))
+        self.used = {}
+        self.hits = 0
+
+    # function to remove the least recently used results until the cache is back under 90% of max_bytes. Must be
+    # called inside a transaction.
+    def _evict(self):
+        total = self.conn.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        while total - removed > target:
+            rows = self.conn.execute('SELECT key, size FROM designs ORDER BY last_used LIMIT 256').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.conn.execute('DELETE FROM designs WHERE key = ?', (key,))
+                removed += size
+                if total - removed <= target:
+                    break
+        self.conn.execute("UPDATE stats SET value = value - ? WHERE name = 'bytes'", (removed,))
+
+    # function to return the hit/miss counters and stored size of the cache as a dictionary
+    def stats(self):
+        self.flush()
+        return dict(self.conn.execute('SELECT name, value FROM stats').fetchall())
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+### FUNCTIONS
+# function to open the cache that design_primers will use in this process. Passing cache_dir=None turns caching off
+# (writing the hits of the cache that was open). The cache is also closed when a worker process that opened it exits
+# normally, so that its last hits are counted.
+def open_cache(cache_dir, max_bytes=1024 ** 3):
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = DesignCache(cache_dir, max_bytes) if cache_dir else None
+    if _cache is not None and multiprocessing.parent_process() is not None:
+        multiprocessing.util.Finalize(_cache, _cache.close, exitpriority=10)
+
+
+# function to have design_primers add the seconds taken by each call in this process to the list call_times, or to stop
+# timing the calls with None
+def time_calls(call_times):
+    global _call_times
+    _call_times = call_times
+
+
+# function used by the designers in place of primer3.bindings.design_primers, going through the cache when one is open
+def design_primers(seq_args, global_args):
+    if _call_times is not None:
+        start = time.perf_counter()
+        result = _design_primers(seq_args, global_args)
+        _call_times.append(time.perf_counter() - start)
+        return result
+    return _design_primers(seq_args, global_args)
+
+
+def _design_primers(seq_args, global_args):
+    if _cache is None:
+        return primer3.bindings.design_primers(seq_args, global_args)
+    return _cache.design(seq_args, global_args)
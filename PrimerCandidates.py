@@ -0,0 +1,267 @@
+import bisect
+import primer3
+from PrimerCache import design_primers
+from PrimerFilters import reverse_complement
+
+# primer3's own defaults for the pair and oligo limits that are only checked once an oligo is used in a pair. They are
+# used whenever the global args passed in do not set them.
+default_limits = {
+    'PRIMER_MAX_SELF_ANY_TH': 47.0,
+    'PRIMER_MAX_SELF_END_TH': 47.0,
+    'PRIMER_MAX_HAIRPIN_TH': 47.0,
+    'PRIMER_PAIR_MAX_COMPL_ANY_TH': 47.0,
+    'PRIMER_PAIR_MAX_COMPL_END_TH': 47.0,
+    'PRIMER_PAIR_MAX_DIFF_TM': 100.0,
+    'PRIMER_SALT_MONOVALENT': 50.0,
+    'PRIMER_SALT_DIVALENT': 1.5,
+    'PRIMER_DNTP_CONC': 0.6,
+    'PRIMER_DNA_CONC': 50.0,
+}
+
+
+### CLASSES
+# One candidate oligo from primer3's pick_primer_list task. start is the 5' end for a left primer and the 3' end for a
+# right primer, as in primer3's PRIMER_LEFT_n / PRIMER_RIGHT_n output. first and last are the leftmost and rightmost
+# bases it covers on the template.
+class Oligo:
+    __slots__ = ('start', 'length', 'first', 'last', 'quality', 'sequence', 'tm', 'gc', 'end_stability')
+
+    def __init__(self, start, length, first, quality, sequence, tm, gc, end_stability):
+        self.start = start
+        self.length = length
+        self.first = first
+        self.last = first + length - 1
+        self.quality = quality
+        self.sequence = sequence
+        self.tm = tm
+        self.gc = gc
+        self.end_stability = end_stability
+
+
+# The left and right primer candidates for one template, found with primer3's pick_primer_list task and then paired in
+# Python for as many targets as needed (e.g. both the start and the stop codon of a gene), instead of running a full
+# design for each target. Pairing follows primer3's own choose_pair_or_triple: oligos are tried in primer3's order, the
+# self-dimer, hairpin and pair dimer checks are only done for pairs that could beat the best pair found so far, and ties
+# are broken in the same way, so pairs() returns the same pairs in the same order as a generic design with that target.
+# The list calls leave out those thermodynamic checks (they are what makes pick_primer_list slow) and they are done here
+# instead with primer3's ThermoAnalysis, once per oligo sequence whatever the number of targets.
+#
+# left_regions and right_regions are lists of (start, end) parts of the template that left and right primers can come
+# from (by default all of it). Each side is found with one primer3 call over those parts, with any gaps between them
+# excluded, so oligos are scored once where the parts overlap and not at all in between.
+class CandidateSet:
+    def __init__(self, ID, template, global_args, left_regions=None, right_regions=None):
+        self.global_args = global_args
+        self.limits = dict(default_limits)
+        self.limits.update((k, v) for k, v in global_args.items() if k in default_limits)
+        self.thermo = primer3.thermoanalysis.ThermoAnalysis(
+            mv_conc=self.limits['PRIMER_SALT_MONOVALENT'], dv_conc=self.limits['PRIMER_SALT_DIVALENT'],
+            dntp_conc=self.limits['PRIMER_DNTP_CONC'], dna_conc=self.limits['PRIMER_DNA_CONC'], temp_only=1)
+        self.oligo_ok = {}  # oligo sequence -> (self any, self end, hairpin) or None if it fails one of them
+        self.pair_ok = {}  # (left, right) -> checked pair or None, kept for every target and product size range
+        self.positions = None  # side -> (sorted first bases of its oligos, their places in its list), for near()
+        self.left = self._list_oligos(ID, template, 'LEFT', left_regions or [(0, len(template))])
+        self.right = self._list_oligos(ID, template, 'RIGHT', right_regions or [(0, len(template))])
+
+    # function to run primer3's pick_primer_list task for one side over the given parts of the template, returning the
+    # oligos best first (primer3 sorts them by penalty, then position and length, which the pairing relies on)
+    def _list_oligos(self, ID, template, side, regions):
+        regions = sorted((max(0, start), min(len(template), end)) for start, end in regions)
+        regions = [(start, end) for start, end in regions if start < end]
+        if not regions:
+            return []
+        start = regions[0][0]
+        end = max(region_end for region_start, region_end in regions)
+        # no oligo fits in a shorter template, and primer3 aborts the whole process (not just the call) on one under 3
+        # bases
+        if end - start < self.global_args.get('PRIMER_MIN_SIZE', 18):
+            return []
+        excluded = []
+        covered = regions[0][1]
+        for region_start, region_end in regions[1:]:
+            if region_start > covered:
+                excluded.append([covered - start, region_start - covered])
+            covered = max(covered, region_end)
+
+        # no target, and the excluded regions always given, as primer3-py can otherwise carry them over from its
+        # previous call
+        seq_args = {'SEQUENCE_ID': ID, 'SEQUENCE_TEMPLATE': template[start:end], 'SEQUENCE_TARGET': [],
+                    'SEQUENCE_EXCLUDED_REGION': excluded}
+        list_args = dict(self.global_args)
+        list_args.update({
+            'PRIMER_TASK': 'pick_primer_list',
+            'PRIMER_PICK_LEFT_PRIMER': int(side == 'LEFT'),
+            'PRIMER_PICK_RIGHT_PRIMER': int(side == 'RIGHT'),
+            'PRIMER_NUM_RETURN': (end - start) * (self.global_args.get('PRIMER_MAX_SIZE', 27) + 1),
+            'PRIMER_THERMODYNAMIC_OLIGO_ALIGNMENT': 0,
+            'PRIMER_MAX_SELF_ANY': 1000,
+            'PRIMER_MAX_SELF_END': 1000,
+        })
+        results = design_primers(seq_args, list_args)
+
+        oligos = []
+        for i in range(results.get('PRIMER_%s_NUM_RETURNED' % side, 0)):
+            key = 'PRIMER_%s_%d' % (side, i)
+            position, length = results[key]
+            first = position + start if side == 'LEFT' else position + start - length + 1
+            oligos.append(Oligo(position + start, length, first, results[key + '_PENALTY'], results[key + '_SEQUENCE'],
+                                results[key + '_TM'], results[key + '_GC_PERCENT'], results[key + '_END_STABILITY']))
+        return oligos
+
+    # function to return the self any, self end and hairpin melting temperatures of an oligo, or None if one of them is
+    # over its limit, in the same way as primer3 (negative temperatures count as 0).
+    def _check_oligo(self, oligo):
+        seq = oligo.sequence.upper()
+        if seq in self.oligo_ok:
+            return self.oligo_ok[seq]
+        result = None
+        # hairpin first, as it is by far the quickest of the three to work out
+        hairpin = max(0.0, self.thermo.calc_hairpin(seq).tm)
+        if hairpin <= self.limits['PRIMER_MAX_HAIRPIN_TH']:
+            self_any = max(0.0, self.thermo.calc_homodimer(seq).tm)
+            if self_any <= self.limits['PRIMER_MAX_SELF_ANY_TH']:
+                self_end = max(0.0, self.thermo.calc_end_stability(seq, seq).tm)
+                if self_end <= self.limits['PRIMER_MAX_SELF_END_TH']:
+                    result = (self_any, self_end, hairpin)
+        self.oligo_ok[seq] = result
+        return result
+
+    # function to check a left and right oligo as a pair, as primer3's characterize_pair does with the default settings.
+    # Returns (penalty, left, right, compl any, compl end) or None if the pair can't be used.
+    def _check_pair(self, left, right):
+        if (left, right) not in self.pair_ok:
+            self.pair_ok[(left, right)] = self._characterize_pair(left, right)
+        return self.pair_ok[(left, right)]
+
+    def _characterize_pair(self, left, right):
+        if abs(left.tm - right.tm) > self.limits['PRIMER_PAIR_MAX_DIFF_TM']:
+            return None
+        if self._check_oligo(left) is None or self._check_oligo(right) is None:
+            return None
+        forward = left.sequence.upper()
+        reverse = right.sequence.upper()
+        compl_any = max(0.0, self.thermo.calc_heterodimer(forward, reverse).tm)
+        if compl_any > self.limits['PRIMER_PAIR_MAX_COMPL_ANY_TH']:
+            return None
+        compl_end = max(0.0, self.thermo.calc_end_stability(forward, reverse).tm,
+                        self.thermo.calc_end_stability(reverse, forward).tm)
+        if compl_end > self.limits['PRIMER_PAIR_MAX_COMPL_END_TH']:
+            return None
+        # primer3 also checks the pair the other way round, against the self end limit
+        forward_rc = reverse_complement(forward)
+        reverse_rc = reverse_complement(reverse)
+        other_end = max(0.0, self.thermo.calc_end_stability(reverse_rc, forward_rc).tm,
+                        self.thermo.calc_end_stability(forward_rc, reverse_rc).tm)
+        if other_end > compl_end:
+            if other_end > self.limits['PRIMER_MAX_SELF_END_TH']:
+                return None
+            compl_end = other_end
+        return (left.quality + right.quality, left, right, compl_any, compl_end)
+
+    # function to pick the num best pairs whose product spans target ([start, length] on the template) without either
+    # oligo overlapping an excluded region. The result is laid out like primer3's design_primers output.
+    def pairs(self, target, excluded=(), num=5, product_range=None):
+        lower, upper = product_range or self.global_args['PRIMER_PRODUCT_SIZE_RANGE']
+        target_first, target_last = target[0], target[0] + target[1] - 1
+        excluded = [(region_start, region_start + region_len - 1) for region_start, region_len in excluded]
+        lefts = [o for o in self.left if o.last < target_first and not _overlaps(o, excluded)]
+        rights = [o for o in self.right if o.first > target_last and not _overlaps(o, excluded)]
+        return self.pick(lefts, rights, num, (lower, upper))
+
+    # function to pick the num best pairs of the left and right oligos given (each in primer3's order, as in self.left
+    # and self.right) with a product of lower to upper bases, laid out like primer3's design_primers output
+    def pick(self, lefts, rights, num=5, product_range=None):
+        lower, upper = product_range or self.global_args['PRIMER_PRODUCT_SIZE_RANGE']
+        chosen = []
+        used = set()  # (left, right) of the pairs already chosen
+        while lefts and len(chosen) < num:
+            best = None
+            best_quality = float('inf')
+            for right in rights:
+                # the oligos are sorted by quality, so no later pair can be better than the best one found so far
+                if right.quality + lefts[0].quality > best_quality:
+                    break
+                for left in lefts:
+                    if left.quality + right.quality > best_quality:
+                        break
+                    size = right.start - left.start + 1
+                    if size < lower or size > upper or (left, right) in used:
+                        continue
+                    pair = self._check_pair(left, right)
+                    if pair is not None and (best is None or _better_pair(pair, best)):
+                        best = pair
+                        best_quality = pair[0]
+                    if best_quality == 0:
+                        break
+                if best_quality == 0:
+                    break
+            if best is None:
+                break
+            chosen.append(best)
+            used.add((best[1], best[2]))
+
+        results = {'PRIMER_LEFT_EXPLAIN': 'ok %d' % len(lefts), 'PRIMER_RIGHT_EXPLAIN': 'ok %d' % len(rights),
+                   'PRIMER_PAIR_EXPLAIN': 'ok %d' % len(chosen),
+                   'PRIMER_LEFT_NUM_RETURNED': len(chosen), 'PRIMER_RIGHT_NUM_RETURNED': len(chosen),
+                   'PRIMER_INTERNAL_NUM_RETURNED': 0, 'PRIMER_PAIR_NUM_RETURNED': len(chosen)}
+        for n, (penalty, left, right, compl_any, compl_end) in enumerate(chosen):
+            left_any, left_end, left_hairpin = self._check_oligo(left)
+            right_any, right_end, right_hairpin = self._check_oligo(right)
+            results.update([
+                ('PRIMER_PAIR_%d_PENALTY' % n, penalty),
+                ('PRIMER_LEFT_%d_PENALTY' % n, left.quality),
+                ('PRIMER_RIGHT_%d_PENALTY' % n, right.quality),
+                ('PRIMER_LEFT_%d_SEQUENCE' % n, left.sequence),
+                ('PRIMER_RIGHT_%d_SEQUENCE' % n, right.sequence),
+                ('PRIMER_LEFT_%d' % n, [left.start, left.length]),
+                ('PRIMER_RIGHT_%d' % n, [right.start, right.length]),
+                ('PRIMER_LEFT_%d_TM' % n, left.tm),
+                ('PRIMER_RIGHT_%d_TM' % n, right.tm),
+                ('PRIMER_LEFT_%d_GC_PERCENT' % n, left.gc),
+                ('PRIMER_RIGHT_%d_GC_PERCENT' % n, right.gc),
+                ('PRIMER_LEFT_%d_SELF_ANY_TH' % n, left_any),
+                ('PRIMER_RIGHT_%d_SELF_ANY_TH' % n, right_any),
+                ('PRIMER_LEFT_%d_SELF_END_TH' % n, left_end),
+                ('PRIMER_RIGHT_%d_SELF_END_TH' % n, right_end),
+                ('PRIMER_LEFT_%d_HAIRPIN_TH' % n, left_hairpin),
+                ('PRIMER_RIGHT_%d_HAIRPIN_TH' % n, right_hairpin),
+                ('PRIMER_LEFT_%d_END_STABILITY' % n, left.end_stability),
+                ('PRIMER_RIGHT_%d_END_STABILITY' % n, right.end_stability),
+                ('PRIMER_PAIR_%d_COMPL_ANY_TH' % n, compl_any),
+                ('PRIMER_PAIR_%d_COMPL_END_TH' % n, compl_end),
+                ('PRIMER_PAIR_%d_PRODUCT_SIZE' % n, right.start - left.start + 1),
+            ])
+        return results
+
+    # function to return the oligos of side ('LEFT' or 'RIGHT') whose first base is from first to last on the template,
+    # in primer3's order. The oligos are indexed by position the first time, so that a long template paired for many
+    # targets (e.g. tiled) only looks through those near each target.
+    def near(self, side, first, last):
+        oligos = self.left if side == 'LEFT' else self.right
+        if self.positions is None:
+            self.positions = {}
+            for name, side_oligos in [('LEFT', self.left), ('RIGHT', self.right)]:
+                order = sorted(range(len(side_oligos)), key=lambda i: side_oligos[i].first)
+                self.positions[name] = ([side_oligos[i].first for i in order], order)
+        firsts, order = self.positions[side]
+        return [oligos[i] for i in sorted(order[bisect.bisect_left(firsts, first):bisect.bisect_right(firsts, last)])]
+
+
+### FUNCTIONS
+# function to check if an oligo overlaps any of the (first, last) excluded regions
+def _overlaps(oligo, excluded):
+    for first, last in excluded:
+        if oligo.first <= last and oligo.last >= first:
+            return True
+    return False
+
+
+# function to compare two checked pairs in the same way as primer3's compare_primer_pair: lower penalty (to within
+# 1e-6), then the left primer further right, the right primer further left, then the shorter left and right primers.
+def _better_pair(a, b):
+    if a[0] + 1e-6 < b[0]:
+        return True
+    if a[0] > b[0] + 1e-6:
+        return False
+    return (-a[1].start, a[2].start, a[1].length, a[2].length) < (-b[1].start, b[2].start, b[1].length, b[2].length)
+
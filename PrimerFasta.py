@@ -0,0 +1,140 @@
+import bisect
+import mmap
+import os
+
+
+### CLASSES
+# Reads (ID, sequence) records from a FASTA file without building SeqRecords. The file is memory mapped and indexed
+# once, in the same format as samtools faidx (<fasta>.fai: name, length, offset of the first base, bases per line and
+# bytes per line), and the index is reused as long as it is newer than the FASTA file. A sequence is read by cutting its
+# bytes out of the map and dropping the line breaks, so only that one record is ever copied. The ID is the first word of
+# the header line, as with Biopython's record.id.
+class FastaFile:
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_name = filename + '.fai'
+        self.f = open(filename, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+        # mmap can't map an empty file
+        self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.index = None
+        if os.path.exists(self.index_name) and os.path.getmtime(self.index_name) >= os.path.getmtime(filename):
+            self.index = self._read_index()
+            self._find_starts()
+            # an index that doesn't match the file (e.g. the file was replaced within the same second) is made again
+            if any(self.map[start:start + 1] != b'>' for start in self.starts):
+                self.index = None
+        if self.index is None:
+            self.index = self._build_index()
+            self._find_starts()
+            try:
+                self._write_index()
+            except OSError:
+                pass  # e.g. a read only directory, the index is just built again next time
+        self.names = {entry[0]: i for i, entry in enumerate(self.index)}
+
+    # function to find the start of the header line of each record, and the end of its sequence (where the next header
+    # starts)
+    def _find_starts(self):
+        self.starts = [self.map.rfind(b'\n', 0, entry[2] - 1) + 1 for entry in self.index]
+        self.ends = self.starts[1:] + [self.size]
+
+    # function to index the file: the name, length, offset, bases per line and bytes per line of each record
+    def _build_index(self):
+        index = []
+        pos = 0 if self.map[:1] == b'>' else self.map.find(b'\n>')
+        if pos > 0:
+            pos += 1
+        while pos != -1:
+            header_end = self.map.find(b'\n', pos)
+            if header_end == -1:
+                header_end = self.size
+            header = self.map[pos + 1:header_end].decode().strip()
+            offset = min(header_end + 1, self.size)
+            end = self.map.find(b'\n>', header_end)
+            end = self.size if end == -1 else end + 1
+            sequence = self.map[offset:end]
+            length = len(sequence) - sequence.count(b'\n') - sequence.count(b'\r')
+            first_line = sequence.find(b'\n') + 1 or len(sequence)
+            line_bases = len(sequence[:first_line].rstrip(b'\r\n'))
+            index.append((header.split()[0] if header else '', length, offset, line_bases, first_line))
+            pos = end if end < self.size else -1
+        return index
+
+    def _read_index(self):
+        index = []
+        with open(self.index_name) as f:
+            for line in f:
+                name, length, offset, line_bases, line_width = line.rstrip('\n').split('\t')[:5]
+                index.append((name, int(length), int(offset), int(line_bases), int(line_width)))
+        return index
+
+    def _write_index(self):
+        with open(self.index_name + '.tmp', 'w') as f:
+            for entry in self.index:
+                f.write('%s\t%d\t%d\t%d\t%d\n' % entry)
+        os.replace(self.index_name + '.tmp', self.index_name)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    # function to return the whole sequence of the record called name
+    def __getitem__(self, name):
+        return self._sequence(self.names[name])
+
+    def _sequence(self, i):
+        return self.map[self.index[i][2]:self.ends[i]].translate(None, b'\r\n').decode()
+
+    # function to return bases start to end (0 based, end not included) of the record called name. Only those lines of
+    # the record are read, using the line lengths in the index, so like samtools faidx this needs every line of the
+    # record but the last to be the same length.
+    def fetch(self, name, start, end):
+        name, length, offset, line_bases, line_width = self.index[self.names[name]]
+        start, end = max(0, start), min(end, length)
+        if start >= end:
+            return ''
+        first = offset + start // line_bases * line_width + start % line_bases
+        last = offset + (end - 1) // line_bases * line_width + (end - 1) % line_bases + 1
+        return self.map[first:last].translate(None, b'\r\n').decode()
+
+    # function to yield (ID, sequence) for each record whose header line starts in the byte range start to end of the
+    # file (all of them by default), in file order. Used with shards() so that each worker reads its own records.
+    def records(self, start=0, end=None):
+        if end is None:
+            end = self.size
+        for i in range(bisect.bisect_left(self.starts, start), bisect.bisect_left(self.starts, end)):
+            yield self.index[i][0], self._sequence(i)
+
+    # function to yield (index, ID, sequence) for each record whose ID keep(ID) is true, in file order, index being its
+    # position in the file. The sequences of the other records are never read.
+    def select(self, keep):
+        for i, entry in enumerate(self.index):
+            if keep(entry[0]):
+                yield i, entry[0], self._sequence(i)
+
+    # function to split the file into n byte ranges of about the same size, each starting at a record's header line,
+    # so that every record is in exactly one of them. Fewer ranges are returned if there are fewer records than n.
+    def shards(self, n):
+        cuts = [0]
+        for k in range(1, n):
+            # the first record starting at or after the k-th n-th of the file
+            i = bisect.bisect_left(self.starts, self.size * k // n)
+            start = self.starts[i] if i < len(self.starts) else self.size
+            if start > cuts[-1]:
+                cuts.append(start)
+        cuts.append(self.size)
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
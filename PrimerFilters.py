@@ -1,65 +1,136 @@
 import re
 
+# restriction enzymes looked for in the primer products when no enzyme table is given: name -> recognition site
+default_enzymes = {'bsaI': 'GGTCTC', 'bsmbI': 'CGTCTC', 'bspqI': 'GCTCTTC', 'btgzI': 'GCGATG'}
+
+# IUPAC codes allowed in recognition sites, as regex character classes
+iupac = {'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'R': '[AG]', 'Y': '[CT]', 'S': '[CG]', 'W': '[AT]', 'K': '[GT]',
+         'M': '[AC]', 'B': '[CGT]', 'D': '[AGT]', 'H': '[ACT]', 'V': '[ACG]', 'N': '[ACGT]'}
+complement = str.maketrans('ACGTRYSWKMBDHVN', 'TGCAYRSWMKVHDBN')
+
+# bytes.translate table giving the case of each base of a record for RecordLayout: 1 for upper case and 0 for lower case
+# bases (including the ambiguity codes), 2 for N and n, which can be in either the CDS or a flank, and 3 for anything
+# that isn't a base at all
+case_table = bytearray(b'\x03' * 256)
+for base in 'ACGTRYSWKMBDHV':
+    case_table[ord(base)], case_table[ord(base.lower())] = 1, 0
+case_table[ord('N')] = case_table[ord('n')] = 2
+case_table = bytes(case_table)
+
 ### FUNCTIONS
-# function to search the input fasta for the first uppercase letter. Input fasta seq has the CDS in all uppercase and
-# flanking regions in lower case.
-def find_CDS_start(sequence):
-    for i in range(len(sequence)):
-        if sequence[i].isupper():
-            return sequence[i]
+# function to return the reverse complement of an (upper case) sequence
+def reverse_complement(sequence):
+    return sequence.translate(complement)[::-1]
+
+# function to read a table of restriction enzymes, one per line as name and recognition site separated by a tab, comma
+# or spaces. Blank lines and lines starting with # are ignored.
+def load_enzymes(filename):
+    enzymes = {}
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = re.split(r'[\s,]+', line)
+            if len(fields) < 2:
+                raise ValueError('Enzyme table line should be a name and a recognition site: %r' % line)
+            name, site = fields[0], fields[1].upper()
+            if not site or any(base not in iupac for base in site):
+                raise ValueError('Invalid recognition site for %s: %r' % (name, fields[1]))
+            enzymes[name] = site
+    return enzymes
+
+
+### CLASSES
+# Scans a sequence for the recognition sites of a set of restriction enzymes on both strands, in either case. This is
+# not a single pass: the sequence is upper cased once and then searched once for each site and once for its reverse
+# complement (unless the site is palindromic), with str.find for plain sites, which runs in C and is as fast as one
+# combined regex in Python's re engine would be. Sites with IUPAC ambiguity codes (e.g. GCCNNNNNGGC) are looked for
+# with a regex lookahead instead. Each search stops at the first site, as only that is needed for the columns, so not
+# every site of an enzyme is reported.
+class RestrictionScanner:
+    def __init__(self, enzymes=None):
+        if enzymes is None:
+            enzymes = default_enzymes
+        self.names = list(enzymes)
+        self.sites = []  # (name, strand, site, compiled site or None if the site is plain bases)
+        for name, site in enzymes.items():
+            site = site.upper()
+            rc = reverse_complement(site)
+            for strand, s in [('+', site), ('-', rc)]:
+                if strand == '-' and rc == site:
+                    break  # palindromic site, the reverse strand would give the same matches again
+                if all(base in 'ACGT' for base in s):
+                    self.sites.append((name, strand, s, None))
+                else:
+                    self.sites.append((name, strand, s, re.compile('(?=' + ''.join(iupac[b] for b in s) + ')')))
 
-# function that looks for bsaI in the coding sequence.
-def bsa_in_CDS(sequence):
-    if re.search(r'GGTCTC', sequence) or re.search(r'GAGACC', sequence):
-        return True
-    else:
-        return False
+    # function to find the first position of one site in an upper cased sequence, or -1
+    @staticmethod
+    def _first(sequence, site, pattern):
+        if pattern is None:
+            return sequence.find(site)
+        m = pattern.search(sequence)
+        return m.start() if m else -1
 
-# function that looks for bsa in the primers.
-def bsa_in_primer(primer):
-    if re.search(r'ggtctc', primer) or re.search(r'gagacc', primer):
-        return True
-    else:
-        return False
+    # function to return the csv columns for a primer product: '<enzyme> in Product' and '<enzyme> Start' for each
+    # enzyme. The start is that of the site nearest the start of the product on either strand, where the designers used
+    # to give a forward strand site ahead of any reverse strand one, wherever it was.
+    def columns(self, sequence):
+        sequence = sequence.upper()
+        first = {}
+        for name, strand, site, pattern in self.sites:
+            pos = self._first(sequence, site, pattern)
+            if pos != -1 and (name not in first or pos < first[name]):
+                first[name] = pos
+        columns = {}
+        for name in self.names:
+            if name in first:
+                columns[name + ' in Product'] = 'Yes'
+                columns[name + ' Start'] = first[name]
+            else:
+                columns[name + ' in Product'] = 'No'
+                columns[name + ' Start'] = 'n/a'
+        return columns
 
-def bsmbI_in_primer(primer):
-    if re.search(r'cgtctc', primer) or re.search(r'gagacg', primer):
-        return True
-    else:
-        return False
+    # function to return the csv headings for the enzyme columns, in the same order as columns()
+    def headings(self):
+        headings = []
+        for name in self.names:
+            headings += [name + ' in Product', name + ' Start']
+        return headings
 
-def bspqI_in_primer(primer):
-    if re.search(r'gctcttc', primer) or re.search(r'gaagagc', primer):
-        return True
-    else:
-        return False
 
-def btgzI_in_primer(primer):
-    if re.search(r'gcgatg', primer) or re.search(r'catcgc', primer):
-        return True
-    else:
-        return False
+# Where the CDS of a record is, worked out from the case of its bases with a few passes of bytes methods in C rather
+# than by looking at each base in Python: cds_start and cds_end (0 based, end not included) are the first and last upper
+# case bases, cds_len the bases between them, and left_flank and right_flank the bases either side. mask has the case
+# of every base (see case_table). N is taken as either case, so a run of N in a flank doesn't look like the start of the
+# CDS. problems lists what is wrong with a record that primers can't be designed for: no upper case CDS, more than one
+# upper case stretch (N aside), bases other than A, C, G, T and N, or fewer bases than min_length (the smallest product
+# size), both of which primer3 rejects.
+class RecordLayout:
+    __slots__ = ('length', 'mask', 'cds_start', 'cds_end', 'cds_len', 'left_flank', 'right_flank', 'problems')
 
-# function to remove some of the clunkier bits of info from primer3 output
-def cleanupdata(list_of_primers):
-    newlist = list_of_primers
-    toremove = ['PRIMER_LEFT_EXPLAIN', 'PRIMER_RIGHT_EXPLAIN', 'PRIMER_PAIR_EXPLAIN', 'PRIMER_LEFT_NUM_RETURNED',
-                'PRIMER_RIGHT_NUM_RETURNED', 'PRIMER_INTERNAL_NUM_RETURNED', 'PRIMER_PAIR_NUM_RETURNED']
-    for key in toremove:
-        del newlist[key]
-    return newlist
+    def __init__(self, sequence, min_length=0):
+        data = sequence.encode('ascii', 'replace')
+        self.length = len(data)
+        self.mask = data.translate(case_table)
+        self.cds_start = self.mask.find(1)
+        self.cds_end = self.mask.rfind(1) + 1
+        self.problems = []
+        if self.cds_start == -1:
+            self.cds_start = self.cds_end = 0
+            self.problems.append('no upper case CDS')
+        self.cds_len = self.cds_end - self.cds_start
+        self.left_flank = self.cds_start
+        self.right_flank = self.length - self.cds_end
 
-# function to replace the Primer3 keys with our own so that each dictionary uses same keys, for easy writing to csv
-def replacekey(finallist):
-    replacekeys = ['Pair Penalty', 'Left Penalty', 'Right Penalty', 'Primer Forward', 'Primer Reverse',
-                   'Left (Start, Length)', 'Right (Start, Length)', 'Left TM', 'Right TM', 'Left GC%', 'Right GC%',
-                   'Left Self Any TH', 'Right Self Any TH', 'Left Self End TH', 'Right Self End TH', 'Left Hairpin TH',
-                   'Right Hairpin TH', 'Left End Stability', 'Right End Stability', 'Pair Compl Any TH',
-                   'Pair Compl End TH', 'Pair Product Size', 'Primer', 'Gene', 'Flank', 'bsaI in Product', 'bsaI Start',
-                   'Primer Product Sequence', 'bsmbI in Product', 'bsmbI Start', 'bspqI in Product', 'bspqI Start',
-                   'btgzI in Product', 'btgzI Start']
-    for i in range(len(finallist)):
-        curr_keys = list(finallist[i].copy().keys())
-        for j in range(len(replacekeys)):
-            finallist[i][replacekeys[j]] = finallist[i].pop(str(curr_keys[j]))
-    return finallist
+        cases = self.mask.translate(None, b'\x02\x03')
+        islands = cases.count(b'\x00\x01') + cases.startswith(b'\x01')
+        if islands > 1:
+            self.problems.append('%d separate upper case stretches' % islands)
+        others = sorted(set(data.translate(None, b'ACGTNacgtn').decode()))
+        if others:
+            self.problems.append('bases other than ACGTN (%s)' % ', '.join(repr(c) for c in others))
+        if self.length < min_length:
+            self.problems.append('%d bases, shorter than the smallest product (%d)' % (self.length, min_length))
@@ -0,0 +1,122 @@
+import contextlib
+import csv
+import json
+import math
+import time
+import PrimerCache
+
+# upper bounds in ms of the latency histogram buckets (the last bucket holds everything slower)
+histogram_bounds = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+### CLASSES
+# Wraps a designer's design_record (with its settings already filled in, e.g. by functools.partial) so that it returns
+# (pairs, metrics) for each record instead of just the pairs. The metrics are the gene ID, template length, wall time
+# of the whole record, the time of each primer3 call made for it and the number of pairs returned. Only used when
+# metrics are asked for, so that a normal run has no timing overhead at all. Picklable, to be sent to worker processes.
+class MeasuredDesign:
+    def __init__(self, design):
+        self.design = design
+
+    def __call__(self, record):
+        ID, SEQ = record
+        call_times = []
+        PrimerCache.time_calls(call_times)
+        start = time.perf_counter()
+        try:
+            pairs = self.design(record)
+        finally:
+            seconds = time.perf_counter() - start
+            PrimerCache.time_calls(None)
+        return pairs, {'gene': ID, 'template_length': len(SEQ), 'seconds': seconds, 'primer3_calls': call_times,
+                       'pairs': len(pairs)}
+
+
+# Collects the metrics of every record designed in a run and writes them out as two sidecar files: <prefix>.csv with
+# one line per record, and <prefix>.json with a summary of the run, histograms of the record and primer3 call latencies
+# and the slowest genes.
+class MetricsCollector:
+    def __init__(self):
+        self.records = []
+
+    def add(self, metrics):
+        self.records.append(metrics)
+
+    # function to take the (pairs, metrics) results of a MeasuredDesign, keeping the metrics and yielding the pairs
+    def collect(self, results):
+        for pairs, metrics in results:
+            self.add(metrics)
+            yield pairs
+
+    # function to return the summary of the run as a dictionary, with the slowest genes first in 'slowest'
+    def summary(self, slowest=10):
+        record_ms = [m['seconds'] * 1000 for m in self.records]
+        call_ms = [seconds * 1000 for m in self.records for seconds in m['primer3_calls']]
+        by_time = sorted(self.records, key=lambda m: m['seconds'], reverse=True)
+        return {
+            'records': len(self.records),
+            'pairs': sum(m['pairs'] for m in self.records),
+            'records_without_pairs': sum(1 for m in self.records if m['pairs'] == 0),
+            'record_seconds': sum(record_ms) / 1000,
+            'primer3_calls': len(call_ms),
+            'primer3_seconds': sum(call_ms) / 1000,
+            'record_ms': latency_stats(record_ms),
+            'primer3_call_ms': latency_stats(call_ms),
+            'slowest': [{'gene': m['gene'], 'ms': m['seconds'] * 1000, 'template_length': m['template_length'],
+                         'primer3_calls': len(m['primer3_calls']), 'pairs': m['pairs']} for m in by_time[:slowest]]
+        }
+
+    def write(self, prefix, slowest=10):
+        with open(prefix + '.json', 'w') as f:
+            json.dump(self.summary(slowest), f, indent=2)
+        with open(prefix + '.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Gene', 'Template Length', 'Record ms', 'Primer3 Calls', 'Primer3 ms', 'Pairs'])
+            for m in self.records:
+                writer.writerow([m['gene'], m['template_length'], '%.3f' % (m['seconds'] * 1000),
+                                 len(m['primer3_calls']), '%.3f' % (sum(m['primer3_calls']) * 1000), m['pairs']])
+
+
+### FUNCTIONS
+# function to return the count, mean, percentiles, max and a histogram (bucket upper bound in ms -> count) of a list of
+# latencies in ms
+def latency_stats(ms):
+    if not ms:
+        return {'count': 0}
+    ms = sorted(ms)
+    histogram = dict.fromkeys(['<=%g' % bound for bound in histogram_bounds] + ['>%g' % histogram_bounds[-1]], 0)
+    for value in ms:
+        for bound in histogram_bounds:
+            if value <= bound:
+                histogram['<=%g' % bound] += 1
+                break
+        else:
+            histogram['>%g' % histogram_bounds[-1]] += 1
+    return {'count': len(ms), 'mean': sum(ms) / len(ms), 'p50': percentile(ms, 50), 'p90': percentile(ms, 90),
+            'p99': percentile(ms, 99), 'max': ms[-1], 'histogram': histogram}
+
+
+# function to return the p-th percentile of a sorted list (nearest rank)
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+# context manager that runs its block under cProfile and dumps the stats to filename (readable with pstats or
+# snakeviz), printing the top functions by cumulative time. Does nothing if filename is None. Only this process is
+# profiled, so use it with one worker.
+@contextlib.contextmanager
+def profile(filename, top=20):
+    if filename is None:
+        yield
+        return
+    # only imported here, as pstats takes a while to import and most runs aren't profiled
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+        pstats.Stats(filename).sort_stats('cumulative').print_stats(top)
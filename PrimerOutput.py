@@ -0,0 +1,280 @@
+import csv
+import gzip
+import io
+import json
+import os
+
+# the output formats and the file extension of each. csv and jsonl (and their gzipped versions) are written by
+# CheckpointWriter, and parquet and npz by ColumnarWriter.
+formats = {'csv': '.csv', 'csv.gz': '.csv.gz', 'jsonl': '.jsonl', 'jsonl.gz': '.jsonl.gz', 'parquet': '.parquet',
+           'npz': '.npz'}
+
+
+### CLASSES
+# Buffered, resumable writer for the primer .csv. Rows are collected in memory and written out every batch_size
+# records. After each batch the .csv is synced to disk and only then are the finished records appended to a manifest
+# file next to it (<csv>.manifest), one line per record: its index in the input, its ID, the number of rows written and
+# the end offset of those rows in the .csv. A killed run therefore never has a record in the manifest whose rows are
+# not all on disk. When resuming, the .csv is cut back to the end of the last record in the manifest (dropping any
+# half-written batch) and those records are skipped.
+#
+# The rows can also be written as JSON lines, one object per row keyed by the headings (fmt 'jsonl'), and either
+# format can be gzipped ('csv.gz', 'jsonl.gz'). The rows of each record are then compressed as a gzip member of their
+# own, so the file can still be cut back to the end of any record and stays a valid gzip file, which gzip and zcat read
+# as one stream.
+class CheckpointWriter:
+    def __init__(self, filename, fieldnames, settings=None, resume=False, batch_size=100, fmt='csv'):
+        self.filename = filename
+        self.manifest_name = filename + '.manifest'
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.json = fmt.startswith('jsonl')
+        self.compress = fmt.endswith('.gz')
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.chunks = []  # encoded rows of the records waiting to be written
+        self.pending = []  # (index, ID, number of rows, size in bytes) for each of those records
+        self.done = {}  # index -> ID of the records already in the .csv
+
+        header = checkpoint_header(fieldnames, fmt)
+        settings_line = '# ' + json.dumps(settings or {}, sort_keys=True) + '\n'
+        if resume:
+            if not os.path.exists(self.filename):
+                raise FileNotFoundError('Cannot resume, %s does not exist' % self.filename)
+            self.f = open(self.filename, 'r+b')
+            if self.f.read(len(header)) != header:
+                raise ValueError('Cannot resume, %s does not have the expected headings' % self.filename)
+            if not os.path.exists(self.manifest_name):
+                raise FileNotFoundError('Cannot resume, %s has no %s' % (self.filename, self.manifest_name))
+            end = len(header)
+            with open(self.manifest_name, 'r') as m:
+                lines = m.readlines()
+            if not lines or lines[0] != settings_line:
+                raise ValueError('Cannot resume, %s was made with different settings' % self.filename)
+            for line in lines[1:]:
+                if not line.endswith('\n'):
+                    break  # partly written line from a killed run
+                index, ID, rows, offset = line.rstrip('\n').split('\t')
+                self.done[int(index)] = ID
+                end = int(offset)
+            self.f.truncate(end)
+            self.f.seek(end)
+            # rewrite the manifest without any partly written last line, replacing it in one step
+            with open(self.manifest_name + '.tmp', 'w') as m:
+                m.writelines(line for line in lines if line.endswith('\n'))
+            os.replace(self.manifest_name + '.tmp', self.manifest_name)
+            self.manifest = open(self.manifest_name, 'a')
+        else:
+            self.f = open(self.filename, 'wb')
+            self.f.write(header)
+            self.manifest = open(self.manifest_name, 'w')
+            self.manifest.write(settings_line)
+
+    # function to check if a record was finished by the run being resumed. Raises an error if the input has changed
+    # so that a different record is now at that position.
+    def is_done(self, index, ID):
+        if index not in self.done:
+            return False
+        if self.done[index] != ID:
+            raise ValueError('Cannot resume, record %d is %s in the input but %s in %s'
+                             % (index, ID, self.done[index], self.manifest_name))
+        return True
+
+    # function to add all of the rows for one record, each a list of values in the order of fieldnames. Records with no
+    # rows are still added, so that they are not designed again when resuming.
+    def write_record(self, index, ID, rows):
+        if self.json:
+            self.buffer.writelines(json.dumps(dict(zip(self.fieldnames, row))) + '\n' for row in rows)
+        else:
+            self.writer.writerows(rows)
+        data = encode(self.buffer.getvalue(), self.compress)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.write_encoded(index, ID, len(rows), data)
+
+    # function to add the rows of one record as the bytes they are written as, e.g. copied out of another output with
+    # the same headings and format, given the number of rows
+    def write_encoded(self, index, ID, rows, data):
+        self.chunks.append(data)
+        self.pending.append((index, ID, rows, len(data)))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    # function to write the buffered rows to the .csv, sync them and then record the finished records in the manifest
+    def flush(self):
+        if not self.pending:
+            return
+        offset = self.f.tell()
+        self.f.write(b''.join(self.chunks))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+        lines = []
+        for index, ID, rows, size in self.pending:
+            offset += size
+            lines.append('%d\t%s\t%d\t%d\n' % (index, ID, rows, offset))
+        self.manifest.writelines(lines)
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        self.chunks = []
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        self.manifest.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Writer for the columnar formats, with the same methods as CheckpointWriter so the designers can use either. Each
+# column gets one type (see column_type), the (start, length) columns become two integer columns ('Left Start', 'Left
+# Length', ...), 'Yes'/'No' columns become booleans and 'n/a' enzyme starts -1. With fmt 'parquet' each batch of
+# records is written as a row group with pyarrow, which falls back to 'npz' if pyarrow isn't installed: a numpy .npz
+# file with one array per column, written when the writer is closed (the columns are kept as numpy arrays until then).
+# Neither can be cut back to the end of a record, so these runs can't be resumed.
+class ColumnarWriter:
+    def __init__(self, filename, fieldnames, batch_size=100, fmt='parquet'):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.batch_size = batch_size
+        self.columns = []  # (name, type, index of the value in a row, index within a (start, length) value or None)
+        for i, heading in enumerate(fieldnames):
+            if column_type(heading) == 'pair':
+                name = heading.split(' (')[0]
+                self.columns += [(name + ' Start', 'int', i, 0), (name + ' Length', 'int', i, 1)]
+            else:
+                self.columns.append((heading, column_type(heading), i, None))
+        self.rows = []
+        self.records = 0
+        self.arrays = {name: [] for name, kind, i, part in self.columns}
+        self.parquet = None
+        if fmt == 'parquet':
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                print('pyarrow is not installed, writing %s as .npz' % filename)
+                self.filename = os.path.splitext(filename)[0] + formats['npz']
+            else:
+                types = {'str': pyarrow.string(), 'int': pyarrow.int64(), 'float': pyarrow.float64(),
+                         'bool': pyarrow.bool_()}
+                self.schema = pyarrow.schema([(name, types[kind]) for name, kind, i, part in self.columns])
+                self.parquet = pyarrow.parquet.ParquetWriter(self.filename, self.schema, compression='zstd')
+
+    # nothing is ever done already, as these runs can't be resumed
+    def is_done(self, index, ID):
+        return False
+
+    def write_record(self, index, ID, rows):
+        self.rows += rows
+        self.records += 1
+        if self.records >= self.batch_size:
+            self.flush()
+
+    # function to turn the buffered rows into typed columns and write them out (or keep them, for npz)
+    def flush(self):
+        if not self.rows:
+            return
+        import numpy as np
+        dtypes = {'str': str, 'int': np.int64, 'float': np.float64, 'bool': bool}
+        batch = {}
+        for name, kind, i, part in self.columns:
+            values = [row[i] if part is None else row[i][part] for row in self.rows]
+            if kind == 'bool':
+                values = [value == 'Yes' for value in values]
+            elif kind == 'int':
+                values = [-1 if value == 'n/a' else value for value in values]
+            batch[name] = np.array(values, dtype=dtypes[kind])
+        if self.parquet is not None:
+            import pyarrow
+            self.parquet.write_table(pyarrow.table(batch, schema=self.schema))
+        else:
+            for name in batch:
+                self.arrays[name].append(batch[name])
+        self.rows = []
+        self.records = 0
+
+    def close(self):
+        self.flush()
+        if self.parquet is not None:
+            self.parquet.close()
+            return
+        import numpy as np
+        with open(self.filename, 'wb') as f:
+            np.savez_compressed(f, **{name: np.concatenate(arrays) if arrays else np.array([])
+                                      for name, arrays in self.arrays.items()})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+### FUNCTIONS
+# function to turn text into the bytes written to a CheckpointWriter's file, gzipped if compress (with no timestamp, so
+# that the same rows always give the same bytes)
+def encode(text, compress=False):
+    data = text.encode()
+    return gzip.compress(data, mtime=0) if compress and data else data
+
+
+# function to return the bytes a CheckpointWriter's file starts with: the headings line, or nothing for JSON lines
+# (where each row has its headings)
+def checkpoint_header(fieldnames, fmt='csv'):
+    if fmt.startswith('jsonl'):
+        return b''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(fieldnames)
+    return encode(buffer.getvalue(), fmt.endswith('.gz'))
+
+
+# function to open a designer .csv (or .csv.gz) to read or write as text
+def open_table(filename, mode='r'):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', newline='')
+    return open(filename, mode, newline='')
+
+
+# function to yield each row of a designer output as a dictionary keyed by its headings, from a csv or jsonl file
+# (gzipped or not, whole, a shard or merged). The columnar formats are not read, as there is no way to tell whether a
+# run that was stopped finished them.
+def read_rows(filename):
+    if not filename.endswith((formats['csv'], formats['csv.gz'], formats['jsonl'], formats['jsonl.gz'])):
+        raise ValueError('Cannot read %s, only csv and jsonl outputs (gzipped or not) can be read' % filename)
+    with open_table(filename) as f:
+        if filename.endswith((formats['jsonl'], formats['jsonl.gz'])):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+# function to return the type of a column in the columnar formats, from its heading: 'str', 'int', 'float', 'bool' or
+# 'pair' for the (start, length) columns
+def column_type(heading):
+    if heading in ['Parameter Set', 'Gene', 'Flank', 'Primer Forward', 'Primer Reverse', 'Primer Product Sequence']:
+        return 'str'
+    if heading.endswith('(Start, Length)'):
+        return 'pair'
+    if heading.endswith(' in Product'):
+        return 'bool'
+    if heading.endswith((' Start', ' End', ' Hits')) or heading in ['Primer', 'Pair Product Size']:
+        return 'int'
+    return 'float'
+
+
+# function to open the writer for an output format: a CheckpointWriter for csv and jsonl (gzipped or not) and a
+# ColumnarWriter for parquet and npz
+def open_writer(filename, fieldnames, settings=None, resume=False, batch_size=100, fmt='csv'):
+    if fmt in ['parquet', 'npz']:
+        if resume:
+            raise ValueError('Cannot resume, %s output is only complete once the run has finished' % fmt)
+        return ColumnarWriter(filename, fieldnames, batch_size, fmt)
+    return CheckpointWriter(filename, fieldnames, settings, resume, batch_size, fmt)
@@ -0,0 +1,29 @@
+import collections
+import multiprocessing
+
+### FUNCTIONS
+# function to run func over every item, either in this process (workers <= 1) or across a pool of worker processes.
+# Results are yielded in the same order as the input items so the output csv is the same whatever the number of
+# workers. Only max_inflight items are handed to the pool ahead of the one being waited on, so a genome sized input is
+# never read into memory all at once.
+def ordered_map(func, items, workers=1, max_inflight=None, initializer=None, initargs=()):
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+
+    if max_inflight is None:
+        max_inflight = workers * 4
+    with multiprocessing.Pool(workers, initializer, initargs) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        # let the workers exit normally rather than be terminated, so that they finish off (e.g. close their cache)
+        pool.close()
+        pool.join()
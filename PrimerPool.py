@@ -0,0 +1,227 @@
+import array
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+from primer3 import thermoanalysis
+from PrimerCandidates import default_limits
+from PrimerOutput import read_rows
+from PrimerParallel import ordered_map
+
+# the ThermoAnalysis used by the workers of this process, set up by _open_thermo (also used as a worker pool
+# initializer), with the same salt and DNA concentrations as the primer designs
+_thermo = None
+
+
+### CLASSES
+# On-disk cache of heterodimer results, in a SQLite database in cache_dir, keyed by the two (upper case) sequences in
+# sorted order so that A against B and B against A are the same entry. Re-checking a pool after adding a few genes then
+# only works out the dimers of the new primers.
+class DimerCache:
+    def __init__(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'dimers.sqlite'), timeout=600)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS dimers (a TEXT NOT NULL, b TEXT NOT NULL, dg REAL NOT NULL, '
+                          'tm REAL NOT NULL, PRIMARY KEY (a, b))')
+
+    # function to return {(a, b): (dg, tm)} for the pairs of sequences in the list (a <= b) that are in the cache
+    def get_many(self, sequences):
+        wanted = set(sequences)
+        found = {}
+        for i in range(0, len(sequences), 500):
+            chunk = sequences[i:i + 500]
+            query = 'SELECT a, b, dg, tm FROM dimers WHERE a IN (%s)' % ','.join('?' * len(chunk))
+            for a, b, dg, tm in self.conn.execute(query, chunk):
+                if b in wanted:
+                    found[(a, b)] = (dg, tm)
+        return found
+
+    # function to store a list of (a, b, dg, tm) results
+    def put_many(self, results):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO dimers VALUES (?, ?, ?, ?)', results)
+
+    def close(self):
+        self.conn.close()
+
+
+# The heterodimer dG (cal/mol) and Tm of every pair of oligos in a list, read with dg(i, j) and tm(i, j). They are kept
+# as two matrices over the distinct sequences, so each pair of sequences is only worked out once however often it turns
+# up in the list, and not at all if it is already in the DimerCache. The rest are handed out in chunks to worker
+# processes as they are generated, rather than listing all of the pairs first.
+class DimerMatrix:
+    def __init__(self, sequences, workers=1, cache=None, chunk_size=1000):
+        self.sequences = [s.upper() for s in sequences]
+        self.n = len(self.sequences)
+        distinct = sorted(set(self.sequences))
+        position = {s: i for i, s in enumerate(distinct)}
+        self.index = [position[s] for s in self.sequences]
+        self.m = m = len(distinct)
+        self._dg = array.array('d', bytes(8 * m * m))
+        self._tm = array.array('d', bytes(8 * m * m))
+        known = bytearray(m * m)
+
+        def store(a, b, dg, tm):
+            i, j = position[a], position[b]
+            self._dg[i * m + j] = self._dg[j * m + i] = dg
+            self._tm[i * m + j] = self._tm[j * m + i] = tm
+            known[i * m + j] = known[j * m + i] = 1
+
+        if cache is not None:
+            for (a, b), (dg, tm) in cache.get_many(distinct).items():
+                store(a, b, dg, tm)
+        todo = ((distinct[i], distinct[j]) for i in range(m) for j in range(i, m) if not known[i * m + j])
+        chunks = iter(lambda: list(itertools.islice(todo, chunk_size)), [])
+        self.computed = 0
+        for results in ordered_map(_heterodimers, chunks, workers, initializer=_open_thermo):
+            for result in results:
+                store(*result)
+            self.computed += len(results)
+            if cache is not None:
+                cache.put_many(results)
+
+    def dg(self, i, j):
+        return self._dg[self.index[i] * self.m + self.index[j]]
+
+    def tm(self, i, j):
+        return self._tm[self.index[i] * self.m + self.index[j]]
+
+
+### FUNCTIONS
+def _open_thermo():
+    global _thermo
+    _thermo = thermoanalysis.ThermoAnalysis(mv_conc=default_limits['PRIMER_SALT_MONOVALENT'],
+                                            dv_conc=default_limits['PRIMER_SALT_DIVALENT'],
+                                            dntp_conc=default_limits['PRIMER_DNTP_CONC'],
+                                            dna_conc=default_limits['PRIMER_DNA_CONC'])
+
+
+# function to work out the heterodimer of each (a, b) sequence pair in a chunk, returning (a, b, dG, Tm) for each
+def _heterodimers(chunk):
+    results = []
+    for a, b in chunk:
+        result = _thermo.calc_heterodimer(a, b)
+        results.append((a, b, result.dg, max(0.0, result.tm) if result.structure_found else 0.0))
+    return results
+
+
+# function to read the primer pairs of a designer output (see PrimerOutput.read_rows) as {(gene, flank): [(primer
+# number, forward, reverse, product first, product last), ...]}, each list in primer number order. The product is given
+# by its first and last base on the template. Unless every pair is wanted, only the best (lowest
+# numbered) pair of each flank is kept. The output of a sweep has the pairs of every parameter set, which are different
+# designs of the same flanks, so only those of parameter_set are read (it can be left out if there is just one).
+def read_pairs(filename, every_pair=False, parameter_set=None):
+    units = {}
+    sets = set()
+    for row in read_rows(filename):
+        if 'Parameter Set' in row:
+            sets.add(row['Parameter Set'])
+            if parameter_set is not None and row['Parameter Set'] != parameter_set:
+                continue
+        left, right = row['Left (Start, Length)'], row['Right (Start, Length)']
+        if isinstance(left, str):
+            left, right = json.loads(left), json.loads(right)  # '[start, length]' in a .csv, a list in JSON lines
+        units.setdefault((row['Gene'], row['Flank']), []).append(
+            (int(row['Primer']), row['Primer Forward'], row['Primer Reverse'], left[0], right[0]))
+    if parameter_set is not None and parameter_set not in sets:
+        raise ValueError('%s has no parameter set %r' % (filename, parameter_set))
+    if parameter_set is None and len(sets) > 1:
+        raise ValueError('%s is the output of a sweep, choose one of its parameter sets (%s)' %
+                         (filename, ', '.join(sorted(sets))))
+    for unit in units:
+        units[unit].sort()
+        if not every_pair:
+            units[unit] = units[unit][:1]
+    return units
+
+
+# function to list the oligos of every pair, returning the sequences and, for each unit, its pairs as (primer number,
+# index of the forward oligo, index of the reverse oligo)
+def oligo_list(units):
+    sequences = []
+    indexed = {}
+    for unit, pairs in units.items():
+        indexed[unit] = []
+        for number, forward, reverse, first, last in pairs:
+            indexed[unit].append((number, len(sequences), len(sequences) + 1))
+            sequences += [forward, reverse]
+    return sequences, indexed
+
+
+# function to return, for each tile of a gene (from FullDesigner -t), the set of other tiles of the gene whose products
+# overlap its own (those of any of their pairs). Two such tiles can't share a pool, as the forward primer of one and the
+# reverse primer of the other would make a short product of their own, whatever their dimers.
+def overlapping_tiles(units):
+    tiles = {}  # gene -> [(first, last, unit)]
+    for unit, pairs in units.items():
+        if unit[1].startswith('Tile '):
+            tiles.setdefault(unit[0], []).append((min(pair[3] for pair in pairs), max(pair[4] for pair in pairs), unit))
+    apart = {}
+    for gene_tiles in tiles.values():
+        gene_tiles.sort()
+        for i, (first, last, unit) in enumerate(gene_tiles):
+            for other_first, other_last, other in gene_tiles[i + 1:]:
+                if other_first > last:
+                    break
+                apart.setdefault(unit, set()).add(other)
+                apart.setdefault(other, set()).add(unit)
+    return apart
+
+
+# function to return, for each oligo, the set of oligos it forms a dimer with that is too stable to pool them: dG
+# below min_dg (cal/mol), or a Tm above max_tm if that is given. The two oligos of the same pair are not counted, as
+# primer3 has already checked them against each other.
+def find_conflicts(matrix, indexed, min_dg, max_tm=None):
+    partner = {}
+    for pairs in indexed.values():
+        for number, forward, reverse in pairs:
+            partner[forward], partner[reverse] = reverse, forward
+    conflicts = [set() for _ in range(matrix.n)]
+    for i in range(matrix.n):
+        for j in range(i, matrix.n):
+            if j == partner.get(i) or j == i:
+                continue
+            if matrix.dg(i, j) < min_dg or (max_tm is not None and matrix.tm(i, j) > max_tm):
+                conflicts[i].add(j)
+                conflicts[j].add(i)
+    return conflicts
+
+
+# function to return the num most stable dimers between oligos of different units, as (dG, Tm, i, j), most stable first
+def worst_interactions(matrix, indexed, num=50):
+    unit_of = {}
+    for unit, pairs in indexed.items():
+        for number, forward, reverse in pairs:
+            unit_of[forward] = unit_of[reverse] = unit
+    pairs = ((matrix.dg(i, j), matrix.tm(i, j), i, j) for i in range(matrix.n) for j in range(i, matrix.n)
+             if unit_of[i] != unit_of[j])
+    return heapq.nsmallest(num, pairs)
+
+
+# function to greedily share the units out into pools with no conflicting oligos in the same pool, at most pool_size
+# units in each (no limit if None), and none of the units in apart[unit] (e.g. from overlapping_tiles) in the same pool
+# as that unit. The units with the most conflicts are placed first, each in the first pool one of its pairs (tried in
+# primer number order) fits in, or else in a new pool with its best pair. Returns a list of pools, each a list of (unit,
+# primer number).
+def assign_pools(indexed, conflicts, pool_size=None, apart=None):
+    apart = apart or {}
+    order = sorted(indexed, key=lambda unit: -sum(len(conflicts[i]) for i in indexed[unit][0][1:]))
+    pools = []  # [(set of oligo indexes, [(unit, primer number), ...])]
+    for unit in order:
+        for oligos, members in pools:
+            if pool_size is not None and len(members) >= pool_size:
+                continue
+            if any(member in apart.get(unit, ()) for member, number in members):
+                continue
+            fits = [pair for pair in indexed[unit] if not (conflicts[pair[1]] & oligos or conflicts[pair[2]] & oligos)]
+            if fits:
+                number, forward, reverse = fits[0]
+                oligos.update([forward, reverse])
+                members.append((unit, number))
+                break
+        else:
+            number, forward, reverse = indexed[unit][0]
+            pools.append(({forward, reverse}, [(unit, number)]))
+    return [members for oligos, members in pools]
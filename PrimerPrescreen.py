@@ -0,0 +1,109 @@
+import numpy as np
+from PrimerCandidates import default_limits
+from PrimerSpecificity import base_codes
+
+# primer3's nearest neighbour enthalpies (kcal/mol) and entropies (cal/K/mol) for each pair of bases (SantaLucia 1998),
+# indexed by the 2 bit codes of the two bases, and the initiation terms for a G/C or an A/T end
+nn_dh = np.array([[-7.9, -8.4, -7.8, -7.2],
+                  [-8.5, -8.0, -10.6, -7.8],
+                  [-8.2, -9.8, -8.0, -8.4],
+                  [-7.2, -8.2, -8.5, -7.9]])
+nn_ds = np.array([[-22.2, -22.4, -21.0, -20.4],
+                  [-22.7, -19.9, -27.2, -21.0],
+                  [-22.2, -24.4, -19.9, -22.4],
+                  [-21.3, -22.2, -22.7, -22.2]])
+end_dh = np.array([2.3, 0.1, 0.1, 2.3, 0.0])
+end_ds = np.array([4.1, -2.8, -2.8, 4.1, 0.0])
+
+# primer3's defaults for the oligo settings the prescreen checks, used when the global args don't set them
+default_oligo = {'PRIMER_MIN_SIZE': 18, 'PRIMER_MAX_SIZE': 27, 'PRIMER_MIN_TM': 57.0, 'PRIMER_MAX_TM': 63.0,
+                 'PRIMER_MIN_GC': 20.0, 'PRIMER_MAX_GC': 80.0}
+
+# primer3 can only take up to 200 excluded regions, so at most this many (the longest) are added
+max_regions = 100
+
+
+### FUNCTIONS
+# function to return a boolean array of which bases of the template could be part of an oligo that passes primer3's GC
+# and Tm limits, working out the GC% and Tm of every oligo from PRIMER_MIN_SIZE to PRIMER_MAX_SIZE bases at once from
+# running sums. The Tm is primer3's own (SantaLucia with SantaLucia salt corrections), which it matches to within
+# rounding; margin degrees are allowed on top for that and for self-complementary oligos, which primer3 works out a
+# little differently. Oligos with a base other than A, C, G or T are always counted as passing. If the global args ask
+# for another Tm method (or DMSO or formamide) only the GC% is checked.
+def usable_bases(template, global_args, margin=1.0):
+    settings = dict(default_oligo, **default_limits)
+    settings.update((k, v) for k, v in global_args.items() if k in settings)
+    check_tm = (global_args.get('PRIMER_TM_FORMULA', 1) == 1 and global_args.get('PRIMER_SALT_CORRECTIONS', 1) == 1
+                and not global_args.get('PRIMER_DMSO_CONC') and not global_args.get('PRIMER_FORMAMIDE_CONC'))
+    divalent = max(settings['PRIMER_SALT_DIVALENT'], settings['PRIMER_DNTP_CONC'])
+    dntp = settings['PRIMER_DNTP_CONC'] if settings['PRIMER_SALT_DIVALENT'] > 0 else 0.0
+    salt = settings['PRIMER_SALT_MONOVALENT'] + 120 * np.sqrt(divalent - dntp)
+
+    n = len(template)
+    if n == 0:
+        return np.zeros(0, bool)
+    codes = base_codes[np.frombuffer(template.encode(), np.uint8)]
+    steps = codes[:-1] & 3, codes[1:] & 3
+    dh = np.concatenate([[0.0], np.cumsum(nn_dh[steps])])
+    ds = np.concatenate([[0.0], np.cumsum(nn_ds[steps])])
+    gc = np.concatenate([[0], np.cumsum((codes == 1) | (codes == 2))])
+    invalid = np.concatenate([[0], np.cumsum(codes == 4)])
+    ends_dh, ends_ds = end_dh[codes], end_ds[codes]
+    log_dna = 1.987 * np.log(settings['PRIMER_DNA_CONC'] / 4e9)
+
+    # the oligos of each length in turn, at all starts at once, working from slices of the running sums. longest ends up
+    # with the length of the longest passing oligo at each start (0 if none).
+    longest = np.zeros(n, np.int64)
+    for length in range(int(settings['PRIMER_MIN_SIZE']), min(int(settings['PRIMER_MAX_SIZE']), n) + 1):
+        m = n - length + 1
+        gc_percent = (gc[length:] - gc[:m]) * (100.0 / length)
+        ok = (gc_percent >= settings['PRIMER_MIN_GC']) & (gc_percent <= settings['PRIMER_MAX_GC'])
+        if check_tm:
+            oligo_dh = dh[length - 1:] - dh[:m] + ends_dh[:m] + ends_dh[length - 1:]
+            oligo_ds = (ds[length - 1:] - ds[:m] + ends_ds[:m] + ends_ds[length - 1:] +
+                        (0.368 * (length - 1) * np.log(salt / 1000.0) + log_dna))
+            tm = oligo_dh * 1000 / oligo_ds - 273.15
+            ok &= (tm >= settings['PRIMER_MIN_TM'] - margin) & (tm <= settings['PRIMER_MAX_TM'] + margin)
+        ok |= invalid[length:] > invalid[:m]
+        longest[:m][ok] = length
+
+    # the longest passing oligo at each start covers the bases of all of the shorter ones: +1 where it starts and -1
+    # after it ends
+    first = np.flatnonzero(longest)
+    cover = np.bincount(first, minlength=n + 1) - np.bincount(first + longest[first], minlength=n + 1)
+    return np.cumsum(cover[:n]) > 0
+
+
+# function to return the parts of template[start:end] that no oligo passing primer3's GC and Tm limits could overlap,
+# as [start, length] excluded regions in the coordinates of the whole template. Oligos sticking out of the window are
+# taken into account, so the regions hold whatever part of the template primer3 is given. Only runs of at least
+# min_run bases (by default the smallest primer size) are returned, and at most max_regions of the longest ones.
+def hopeless_regions(template, global_args, start=0, end=None, min_run=None, margin=1.0):
+    end = len(template) if end is None else end
+    max_size = int(global_args.get('PRIMER_MAX_SIZE', default_oligo['PRIMER_MAX_SIZE']))
+    min_run = min_run or int(global_args.get('PRIMER_MIN_SIZE', default_oligo['PRIMER_MIN_SIZE']))
+    padded_start, padded_end = max(0, start - max_size + 1), min(len(template), end + max_size - 1)
+    usable = usable_bases(template[padded_start:padded_end], global_args, margin)
+    usable = usable[start - padded_start:end - padded_start]
+
+    edges = np.flatnonzero(np.diff(np.concatenate([[True], usable, [True]]).astype(np.int8)))
+    runs = [(int(run_start), int(run_end - run_start)) for run_start, run_end in zip(edges[::2], edges[1::2])
+            if run_end - run_start >= min_run]
+    runs = sorted(sorted(runs, key=lambda run: -run[1])[:max_regions])
+    return [[run_start + start, run_len] for run_start, run_len in runs]
+
+
+# function to return the parts of a list of (start, end) regions that are outside all of the [start, length] excluded
+# regions
+def outside(regions, excluded):
+    parts = []
+    for region_start, region_end in regions:
+        for excluded_start, excluded_len in sorted(excluded):
+            if excluded_start >= region_end or excluded_start + excluded_len <= region_start:
+                continue
+            if excluded_start > region_start:
+                parts.append((region_start, excluded_start))
+            region_start = max(region_start, excluded_start + excluded_len)
+        if region_start < region_end:
+            parts.append((region_start, region_end))
+    return parts
@@ -0,0 +1,84 @@
+# the .csv heading, PrimerPair attribute and primer3 output key (with %d for the pair number) of each primer3 result
+# column, in .csv order
+pair_fields = [
+    ('Pair Penalty', 'pair_penalty', 'PRIMER_PAIR_%d_PENALTY'),
+    ('Left Penalty', 'left_penalty', 'PRIMER_LEFT_%d_PENALTY'),
+    ('Right Penalty', 'right_penalty', 'PRIMER_RIGHT_%d_PENALTY'),
+    ('Primer Forward', 'forward', 'PRIMER_LEFT_%d_SEQUENCE'),
+    ('Primer Reverse', 'reverse', 'PRIMER_RIGHT_%d_SEQUENCE'),
+    ('Left (Start, Length)', 'left', 'PRIMER_LEFT_%d'),
+    ('Right (Start, Length)', 'right', 'PRIMER_RIGHT_%d'),
+    ('Left TM', 'left_tm', 'PRIMER_LEFT_%d_TM'),
+    ('Right TM', 'right_tm', 'PRIMER_RIGHT_%d_TM'),
+    ('Left GC%', 'left_gc', 'PRIMER_LEFT_%d_GC_PERCENT'),
+    ('Right GC%', 'right_gc', 'PRIMER_RIGHT_%d_GC_PERCENT'),
+    ('Left Self Any TH', 'left_self_any', 'PRIMER_LEFT_%d_SELF_ANY_TH'),
+    ('Right Self Any TH', 'right_self_any', 'PRIMER_RIGHT_%d_SELF_ANY_TH'),
+    ('Left Self End TH', 'left_self_end', 'PRIMER_LEFT_%d_SELF_END_TH'),
+    ('Right Self End TH', 'right_self_end', 'PRIMER_RIGHT_%d_SELF_END_TH'),
+    ('Left Hairpin TH', 'left_hairpin', 'PRIMER_LEFT_%d_HAIRPIN_TH'),
+    ('Right Hairpin TH', 'right_hairpin', 'PRIMER_RIGHT_%d_HAIRPIN_TH'),
+    ('Left End Stability', 'left_end_stability', 'PRIMER_LEFT_%d_END_STABILITY'),
+    ('Right End Stability', 'right_end_stability', 'PRIMER_RIGHT_%d_END_STABILITY'),
+    ('Pair Compl Any TH', 'compl_any', 'PRIMER_PAIR_%d_COMPL_ANY_TH'),
+    ('Pair Compl End TH', 'compl_end', 'PRIMER_PAIR_%d_COMPL_END_TH'),
+    ('Pair Product Size', 'product_size', 'PRIMER_PAIR_%d_PRODUCT_SIZE'),
+]
+
+# the .csv headings for the primer3 results, followed by the enzyme headings, the genome hit headings when primers are
+# checked against a genome and then 'Primer Product Sequence' (or the product coordinates instead of the sequence)
+headings = ['Gene', 'Primer', 'Flank'] + [heading for heading, attribute, key in pair_fields]
+hit_headings = ['Forward Genome Hits', 'Reverse Genome Hits']
+coordinate_headings = ['Product Start', 'Product End']
+
+
+### CLASSES
+# One primer pair designed by primer3 for a gene flank. Each column is read from primer3's output by its own key, so a
+# key primer3 adds or drops can't shift the values into the wrong columns (a missing key raises a KeyError instead).
+# The product and its restriction enzyme columns are filled in by scan(), and the genome hits of the two primers by
+# PrimerSpecificity.check_pairs (if they are checked).
+class PrimerPair:
+    __slots__ = ['gene', 'number', 'flank'] + [attribute for heading, attribute, key in pair_fields] + \
+                ['enzymes', 'hits', 'product']
+
+    def __init__(self, gene, number, flank, results, index):
+        self.gene = gene
+        self.number = number
+        self.flank = flank
+        for heading, attribute, key in pair_fields:
+            setattr(self, attribute, results[key % index])
+        self.enzymes = []
+        self.hits = []
+        self.product = ''
+
+    # function to cut the theoretical product out of the template and check it for bsaI and the other enzymes
+    def scan(self, sequence, scanner):
+        self.product = sequence[self.left[0]:self.right[0] + 1]
+        self.enzymes = list(scanner.columns(self.product).values())
+
+    # function to return the .csv row for the pair, in the order of csv_headings(). With coordinates, the product is
+    # given as the positions of its first and last base in the template (0-based, like the primer positions) rather
+    # than as its sequence.
+    def row(self, coordinates=False):
+        product = [self.left[0], self.right[0]] if coordinates else [self.product]
+        return [self.gene, self.number, self.flank] + [getattr(self, attribute) for heading, attribute, key in
+                                                        pair_fields] + self.enzymes + self.hits + product
+
+
+### FUNCTIONS
+# function to turn the output of one primer3 design into a list of PrimerPairs numbered from 1, each with its product
+# scanned for restriction sites
+def primer_pairs(results, gene, flank, sequence, scanner):
+    pairs = []
+    for index in range(results['PRIMER_PAIR_NUM_RETURNED']):
+        pair = PrimerPair(gene, index + 1, flank, results, index)
+        pair.scan(sequence, scanner)
+        pairs.append(pair)
+    return pairs
+
+
+# function to return all of the .csv headings for a run using this RestrictionScanner, with the genome hit columns if
+# hits is True and the product coordinates instead of its sequence if coordinates is True
+def csv_headings(scanner, hits=False, coordinates=False):
+    return (headings + scanner.headings() + (hit_headings if hits else []) +
+            (coordinate_headings if coordinates else ['Primer Product Sequence']))
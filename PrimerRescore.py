@@ -0,0 +1,158 @@
+import csv
+import itertools
+from primer3 import thermoanalysis
+from PrimerCandidates import default_limits
+from PrimerFilters import reverse_complement
+from PrimerOutput import open_table
+from PrimerParallel import ordered_map
+
+# the reaction conditions that can be changed, as primer3 setting names, and the ThermoAnalysis argument of each
+condition_args = {
+    'PRIMER_SALT_MONOVALENT': 'mv_conc',
+    'PRIMER_SALT_DIVALENT': 'dv_conc',
+    'PRIMER_DNTP_CONC': 'dntp_conc',
+    'PRIMER_DNA_CONC': 'dna_conc',
+}
+
+# the .csv columns worked out again for each primer (with 'Left ' or 'Right ' in front) and for each pair. The Pair
+# Penalty is worked out again too, from the two primer penalties.
+oligo_headings = ['Penalty', 'TM', 'Self Any TH', 'Self End TH', 'Hairpin TH', 'End Stability']
+pair_headings = ['Pair Compl Any TH', 'Pair Compl End TH']
+
+# the primer3 settings the designers' penalties come from: their optimum Tm and size, and primer3's default weights. Of
+# those, only the distance of the Tm and the size from their optimum count towards a primer's penalty (the GC, dimer,
+# hairpin and end stability weights are all 0), and a pair's penalty is just that of its two primers.
+penalty_settings = {'PRIMER_OPT_TM': 55.0, 'PRIMER_OPT_SIZE': 20, 'PRIMER_WT_TM_GT': 1.0, 'PRIMER_WT_TM_LT': 1.0,
+                    'PRIMER_WT_SIZE_GT': 1.0, 'PRIMER_WT_SIZE_LT': 1.0}
+
+# primer3's nearest neighbour free energies (SantaLucia 1998, at 37C, in 10 cal/mol) used for the End Stability of the
+# last 5 bases of a primer, with the initiation term and the penalty for each A/T end
+end_dg = {'AA': -100, 'AC': -144, 'AG': -128, 'AT': -88, 'CA': -145, 'CC': -184, 'CG': -217, 'CT': -128,
+          'GA': -130, 'GC': -224, 'GG': -184, 'GT': -144, 'TA': -58, 'TC': -130, 'TG': -145, 'TT': -100}
+end_init = 196
+end_at = 5
+
+# the ThermoAnalysis used by the workers of this process, set up by _open_thermo (also used as a worker pool
+# initializer) with the conditions being re-scored for
+_thermo = None
+
+
+### FUNCTIONS
+# function to return the conditions of the original designs (primer3's defaults, as the designers don't change them),
+# with any of condition_args changed
+def conditions(**changes):
+    settings = {key: default_limits[key] for key in condition_args}
+    settings.update(changes)
+    return settings
+
+
+def _open_thermo(settings):
+    global _thermo
+    # formamide is given as 0 as in primer3's designs, rather than primer3-py's own default for it
+    _thermo = thermoanalysis.ThermoAnalysis(formamide_conc=0.0,
+                                            **{condition_args[key]: value for key, value in settings.items()})
+
+
+# function to return primer3's End Stability of an oligo, the free energy (kcal/mol, as a positive number) of its last 5
+# bases binding their complement. It does not depend on the salt, but is worked out again with the rest.
+def end_stability(seq):
+    end = seq[-5:]
+    dg = sum(end_dg[end[i:i + 2]] for i in range(len(end) - 1)) + end_init
+    dg += end_at * ((end[0] in 'AT') + (end[-1] in 'AT'))
+    return -dg / 100
+
+
+# function to return primer3's penalty of an oligo with melting temperature tm and length bases, in the same order of
+# sums as primer3 so that it gives the same value as the design did for the same Tm
+def oligo_penalty(tm, length):
+    penalty = 0.0
+    if tm > penalty_settings['PRIMER_OPT_TM']:
+        penalty += penalty_settings['PRIMER_WT_TM_GT'] * (tm - penalty_settings['PRIMER_OPT_TM'])
+    if tm < penalty_settings['PRIMER_OPT_TM']:
+        penalty += penalty_settings['PRIMER_WT_TM_LT'] * (penalty_settings['PRIMER_OPT_TM'] - tm)
+    if length > penalty_settings['PRIMER_OPT_SIZE']:
+        penalty += penalty_settings['PRIMER_WT_SIZE_GT'] * (length - penalty_settings['PRIMER_OPT_SIZE'])
+    if length < penalty_settings['PRIMER_OPT_SIZE']:
+        penalty += penalty_settings['PRIMER_WT_SIZE_LT'] * (penalty_settings['PRIMER_OPT_SIZE'] - length)
+    return penalty
+
+
+# function to work out the oligo columns for each (upper case) sequence in a chunk, returning a list of
+# (sequence, (penalty, Tm, self any, self end, hairpin, end stability)). Negative temperatures count as 0, as in
+# primer3.
+def _oligo_scores(chunk):
+    results = []
+    for seq in chunk:
+        tm = _thermo.calc_tm(seq)
+        results.append((seq, (oligo_penalty(tm, len(seq)), tm, max(0.0, _thermo.calc_homodimer(seq).tm),
+                              max(0.0, _thermo.calc_end_stability(seq, seq).tm),
+                              max(0.0, _thermo.calc_hairpin(seq).tm), end_stability(seq))))
+    return results
+
+
+# function to work out the pair columns for each (forward, reverse) pair of sequences in a chunk, returning a list of
+# ((forward, reverse), (compl any, compl end)). As in primer3's characterize_pair, compl end is the most stable end of
+# the two primers binding each other either way round, or of their reverse complements.
+def _pair_scores(chunk):
+    results = []
+    for forward, reverse in chunk:
+        forward_rc, reverse_rc = reverse_complement(forward), reverse_complement(reverse)
+        compl_end = max(0.0, _thermo.calc_end_stability(forward, reverse).tm,
+                        _thermo.calc_end_stability(reverse, forward).tm,
+                        _thermo.calc_end_stability(reverse_rc, forward_rc).tm,
+                        _thermo.calc_end_stability(forward_rc, reverse_rc).tm)
+        results.append(((forward, reverse), (max(0.0, _thermo.calc_heterodimer(forward, reverse).tm), compl_end)))
+    return results
+
+
+# function to work out func (_oligo_scores or _pair_scores) for the items in chunks of chunk_size, across workers
+# processes, returning {item: its columns}
+def _score_all(func, items, settings, workers=1, chunk_size=500):
+    items = iter(items)
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    scores = {}
+    for results in ordered_map(func, chunks, workers, initializer=_open_thermo, initargs=(settings,)):
+        scores.update(results)
+    return scores
+
+
+# function to return the distinct (upper case) primer sequences and (forward, reverse) pairs of a designer .csv
+def read_oligos(filename):
+    oligos = set()
+    pairs = set()
+    with open_table(filename) as f:
+        for row in csv.DictReader(f):
+            forward, reverse = row['Primer Forward'].upper(), row['Primer Reverse'].upper()
+            oligos.update([forward, reverse])
+            pairs.add((forward, reverse))
+    return oligos, pairs
+
+
+# function to re-score every row of a designer .csv for new conditions (see conditions()), writing it to output with
+# the penalty, Tm, self any, self end, hairpin and end stability of each primer and the penalty, compl any and compl
+# end of each pair worked out again, and every other column as it was (so the Primer numbers are still those of the
+# design's ranking). Each distinct primer and pair is only worked out once, in batches spread across workers processes.
+# Returns the number of rows, primers and pairs.
+def rescore(filename, output, settings, workers=1):
+    oligos, pairs = read_oligos(filename)
+    oligo_scores = _score_all(_oligo_scores, sorted(oligos), settings, workers)
+    pair_scores = _score_all(_pair_scores, sorted(pairs), settings, workers)
+
+    rows = 0
+    with open_table(filename) as f, open_table(output, 'w') as out:
+        reader = csv.reader(f)
+        fieldnames = next(reader)
+        column = {heading: i for i, heading in enumerate(fieldnames)}
+        writer = csv.writer(out)
+        writer.writerow(fieldnames)
+        for row in reader:
+            forward, reverse = row[column['Primer Forward']].upper(), row[column['Primer Reverse']].upper()
+            for side, seq in [('Left', forward), ('Right', reverse)]:
+                for heading, value in zip(oligo_headings, oligo_scores[seq]):
+                    row[column['%s %s' % (side, heading)]] = value
+            for heading, value in zip(pair_headings, pair_scores[(forward, reverse)]):
+                row[column[heading]] = value
+            row[column['Pair Penalty']] = oligo_scores[forward][0] + oligo_scores[reverse][0]
+            writer.writerow(row)
+            rows += 1
+    return rows, len(oligos), len(pairs)
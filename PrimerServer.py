@@ -0,0 +1,155 @@
+import io
+import json
+import multiprocessing
+import os
+import queue
+import socketserver
+import threading
+import time
+import FlankingDesigner
+import FullDesigner
+from PrimerCache import open_cache
+from PrimerFasta import FastaFile
+from PrimerFilters import RestrictionScanner
+from PrimerRecords import csv_headings
+
+# the designer modules a request can ask for, and the settings a request can change from their default_params
+designers = {'full': FullDesigner, 'flanking': FlankingDesigner}
+request_settings = {'full': ['number', 'lower', 'upper', 'enzymes', 'shared', 'prescreen', 'tile', 'overlap'],
+                    'flanking': ['number', 'lower', 'upper', 'enzymes', 'prescreen']}
+
+
+### CLASSES
+# Long running primer design server, so that small jobs don't pay for starting python and importing primer3 each time.
+# Requests are JSON objects, one per line, such as
+#   {"id": 1, "designer": "full", "records": [["Gene_name", "atcgGATCtgac"]], "number": 8, "lower": 200, "upper": 500}
+# with either records or "input", the name of a FASTA file to read them from. designer is "full" (the default) or
+# "flanking", and any of request_settings can be given (the rest are the command line defaults), as well as
+# "coordinates": true to get the product coordinates rather than its sequence in the rows. The answer to each
+# request is streamed back as JSON lines with the same id: first {"id": 1, "headings": [...]}, then {"id": 1, "row":
+# [...]} for each primer pair as soon as its record is designed, and last {"id": 1, "done": true, "pairs": n, "ms": t}
+# or, if the request failed, {"id": 1, "error": "..."}.
+#
+# Requests wait in a queue of at most queue_size, so submit blocks while it is full, and threads requests are worked on
+# at once. Their records are all designed by one pool of worker processes, started (with the primer3 cache opened in
+# each) when the server is, so every record is designed by an already warm process.
+class DesignServer:
+    def __init__(self, workers=1, cache=None, cache_size=1024, queue_size=64, threads=4):
+        self.pool = multiprocessing.Pool(max(1, workers), initializer=open_cache,
+                                         initargs=(cache, cache_size * 1024 ** 2))
+        self.jobs = queue.Queue(queue_size)
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    # function to queue a request, given as a line of JSON, with the function to send each answer (a dictionary) back
+    # with. Returns an Event that is set once the last answer has been sent.
+    def submit(self, line, send):
+        done = threading.Event()
+        self.jobs.put((line, send, done))
+        return done
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            line, send, done = job
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get('id')
+                self._design(request, request_id, send)
+            except Exception as e:
+                # the client may have gone away, in which case there is no one to tell
+                try:
+                    send({'id': request_id, 'error': '%s: %s' % (type(e).__name__, e)})
+                except OSError:
+                    pass
+            finally:
+                done.set()
+
+    # function to design the primers for one request, sending the rows of each record back as soon as it is done
+    def _design(self, request, request_id, send):
+        start = time.perf_counter()
+        name = request.get('designer', 'full')
+        if name not in designers:
+            raise ValueError('unknown designer %r, use one of %s' % (name, ', '.join(designers)))
+        unknown = set(request) - set(request_settings[name]) - {'id', 'designer', 'records', 'input', 'coordinates'}
+        if unknown:
+            raise ValueError('unknown settings %s' % ', '.join(sorted(unknown)))
+        params = dict(designers[name].default_params)
+        params.update((key, request[key]) for key in request_settings[name] if key in request)
+        if 'records' in request:
+            records = [(str(ID), str(SEQ)) for ID, SEQ in request['records']]
+        elif 'input' in request:
+            with FastaFile(request['input']) as fasta:
+                records = list(fasta.records())
+        else:
+            raise ValueError('a request needs records or an input FASTA file')
+
+        coordinates = bool(request.get('coordinates', False))
+        headings = csv_headings(RestrictionScanner(params['enzymes']), coordinates=coordinates)
+        send({'id': request_id, 'headings': headings})
+        count = 0
+        for pairs in self.pool.imap(designers[name].record_design(params), records):
+            for pair in pairs:
+                send({'id': request_id, 'row': pair.row(coordinates)})
+            count += len(pairs)
+        send({'id': request_id, 'done': True, 'pairs': count, 'ms': round((time.perf_counter() - start) * 1000, 1)})
+
+    # function to finish the queued requests and then stop the threads and worker processes
+    def close(self):
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.pool.close()
+        self.pool.join()
+
+
+# Answers the requests sent over one connection to the Unix socket, on that connection
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        serve_stream(self.server.design_server, io.TextIOWrapper(self.rfile, encoding='utf-8'),
+                     io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True))
+
+
+### FUNCTIONS
+# function to return a function that sends an answer as a line of JSON to a text stream, one answer at a time, so
+# that the lines of requests being worked on at once don't get mixed up
+def line_sender(stream):
+    lock = threading.Lock()
+
+    def send(answer):
+        line = json.dumps(answer) + '\n'
+        with lock:
+            stream.write(line)
+            stream.flush()
+    return send
+
+
+# function to serve the requests in a text stream (e.g. stdin) until it ends, sending the answers to another
+def serve_stream(server, requests, answers):
+    send = line_sender(answers)
+    pending = []
+    for line in requests:
+        if line.strip():
+            pending = [done for done in pending if not done.is_set()]
+            pending.append(server.submit(line, send))
+    for done in pending:
+        done.wait()
+
+
+# function to serve requests on a Unix socket at path until interrupted, each connection in its own thread. Any
+# number of requests can be sent on a connection, and their answers come back on it.
+def serve_socket(server, path):
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.ThreadingUnixStreamServer(path, _ConnectionHandler) as listener:
+        listener.daemon_threads = True
+        listener.design_server = server
+        try:
+            listener.serve_forever()
+        finally:
+            os.remove(path)
@@ -0,0 +1,125 @@
+import csv
+import gzip
+import heapq
+import json
+import zlib
+from PrimerFasta import FastaFile
+from PrimerOutput import CheckpointWriter, checkpoint_header
+
+
+### FUNCTIONS
+# function to turn an 'i/N' shard (i from 1 to N) into (i, N)
+def parse_shard(text):
+    try:
+        i, n = [int(part) for part in text.split('/')]
+    except ValueError:
+        raise ValueError('shard %r should be given as i/N, e.g. 1/4' % text)
+    if not 1 <= i <= n:
+        raise ValueError('shard %r should have i from 1 to N' % text)
+    return i, n
+
+
+# function to return which of n shards (from 1 to n) the record with this ID belongs to. It is worked out from a CRC32
+# of the ID, rather than python's hash() which changes between runs, so every node puts every record in the same shard
+# whatever the order or number of records in the input.
+def shard_of(ID, n):
+    return zlib.crc32(ID.encode()) % n + 1
+
+
+# function to return the headings, settings and format of a CheckpointWriter output from its first line and its
+# manifest's settings line
+def _read_output(filename):
+    with open(filename + '.manifest') as m:
+        settings = json.loads(m.readline()[2:])
+    fmt = settings.get('format', 'csv')
+    if fmt not in ['csv', 'csv.gz', 'jsonl', 'jsonl.gz']:
+        raise ValueError('Cannot merge %s, only csv and jsonl outputs (gzipped or not) can be merged' % filename)
+    fieldnames = []
+    if fmt.startswith('csv'):
+        with (gzip.open if fmt.endswith('.gz') else open)(filename, 'rt', newline='') as f:
+            fieldnames = next(csv.reader(f))
+    return fieldnames, settings, fmt
+
+
+# function to yield (index, shard, ID, number of rows, size in bytes) for each finished record in a shard's manifest,
+# in the order they were written (input order), starting after the header of header_size bytes
+def _manifest_records(filename, shard, header_size):
+    offset = header_size
+    with open(filename + '.manifest') as m:
+        m.readline()
+        for line in m:
+            if not line.endswith('\n'):
+                break  # partly written line from a killed run
+            index, ID, rows, end = line.rstrip('\n').split('\t')
+            yield int(index), shard, ID, int(rows), int(end) - offset
+            offset = int(end)
+
+
+# function to merge the outputs of the shards of a sharded run (made with --shard i/N for every i from 1 to N and
+# otherwise the same settings) back into the input order, into output with its own manifest. The result is the same,
+# byte for byte, as an output made without sharding. The records of the shards are k-way merged by their index in the
+# input, using only the manifests, and their rows copied across as they are (gzip members and all), so no more than
+# one record of each shard is ever read into memory. Every record must be in exactly one shard, and in the shard its
+# ID belongs to, with none missing. If the input FASTA file is given, the IDs and the number of records are also
+# checked against it. Returns the number of records merged.
+def merge_shards(filenames, output, fasta=None):
+    outputs = [_read_output(filename) for filename in filenames]
+    fieldnames, settings, fmt = outputs[0]
+    shards = {}
+    for filename, (shard_fieldnames, shard_settings, shard_fmt) in zip(filenames, outputs):
+        shard_settings = dict(shard_settings)
+        if 'shard' not in shard_settings:
+            raise ValueError('%s is not the output of a sharded run' % filename)
+        i, n = parse_shard(shard_settings.pop('shard'))
+        if i in shards:
+            raise ValueError('%s and %s are both shard %d' % (shards[i], filename, i))
+        shards[i] = filename
+        if shard_fieldnames != fieldnames or shard_fmt != fmt or \
+                shard_settings != {key: value for key, value in settings.items() if key != 'shard'}:
+            raise ValueError('%s was made with different settings to %s' % (filename, filenames[0]))
+    n = parse_shard(settings['shard'])[1]
+    missing = [str(i) for i in range(1, n + 1) if i not in shards]
+    if missing:
+        raise ValueError('shards %s of %d are missing' % (', '.join(missing), n))
+
+    header = checkpoint_header(fieldnames, fmt)
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            if f.read(len(header)) != header:
+                raise ValueError('%s does not start with the expected headings' % filename)
+    index_names = None
+    if fasta is not None:
+        with FastaFile(fasta) as f:
+            index_names = [entry[0] for entry in f.index]
+
+    # the manifests are read through twice: first to check that every record is there once, so that nothing is
+    # written for a broken set of shards, then to copy the records across
+    def merged():
+        return heapq.merge(*[_manifest_records(shards[i], i, len(header)) for i in sorted(shards)])
+
+    expected = 0
+    for index, shard, ID, rows, size in merged():
+        if index < expected:
+            raise ValueError('record %d (%s) is in more than one shard' % (index, ID))
+        if index > expected:
+            raise ValueError('records %d to %d are in none of the shards' % (expected, index - 1))
+        if shard_of(ID, n) != shard:
+            raise ValueError('record %d (%s) belongs in shard %d, not %s' % (index, ID, shard_of(ID, n), shards[shard]))
+        if index_names is not None and (index >= len(index_names) or index_names[index] != ID):
+            raise ValueError('record %d is %s in the shards but not in %s' % (index, ID, fasta))
+        expected += 1
+    if index_names is not None and expected != len(index_names):
+        raise ValueError('records %d to %d of %s are in none of the shards' % (expected, len(index_names) - 1, fasta))
+
+    settings = {key: value for key, value in settings.items() if key != 'shard'}
+    files = {i: open(shards[i], 'rb') for i in shards}
+    try:
+        for f in files.values():
+            f.seek(len(header))
+        with CheckpointWriter(output, fieldnames, settings, fmt=fmt) as writer:
+            for index, shard, ID, rows, size in merged():
+                writer.write_encoded(index, ID, rows, files[shard].read(size))
+    finally:
+        for f in files.values():
+            f.close()
+    return expected
@@ -0,0 +1,165 @@
+import itertools
+import json
+import os
+import numpy as np
+from PrimerFasta import FastaFile
+
+# 2 bit code of each base, anything else (N etc.) is 4 and ends up in no k-mer. A^T, C^G and so on are 3, so a code
+# xor 3 is the code of the complementary base.
+base_codes = np.full(256, 4, dtype=np.uint8)
+for base, code in zip('ACGT', range(4)):
+    base_codes[ord(base)] = base_codes[ord(base.lower())] = code
+
+# number of bases encoded at once while building an index
+chunk_bases = 1 << 23
+
+
+### CLASSES
+# Counts of every k-mer on the forward strand of a reference FASTA (e.g. a genome), for checking where primers could
+# bind. The index is a sorted array of the distinct k-mers (2 bits a base, so k can be up to 32) and an array of how
+# often each one occurs. Both are saved as .npy files next to the reference (<reference>.k<k>.kmers.npy and
+# .counts.npy, plus a .json describing them) and memory mapped when the index is opened again, so it is only built once
+# and only the pages that queries touch are read.
+class KmerIndex:
+    def __init__(self, reference, k=15):
+        if not 1 <= k <= 32:
+            raise ValueError('k-mer length must be between 1 and 32, not %d' % k)
+        self.reference = reference
+        self.k = k
+        prefix = '%s.k%d' % (reference, k)
+        self.kmers_name, self.counts_name, self.info_name = [prefix + ext for ext in
+                                                             ['.kmers.npy', '.counts.npy', '.json']]
+        info = {'k': k, 'size': os.path.getsize(reference), 'mtime': os.path.getmtime(reference)}
+        if not self._load(info):
+            self._build()
+            np.save(self.kmers_name, self.kmers)
+            np.save(self.counts_name, self.counts)
+            with open(self.info_name, 'w') as f:
+                json.dump(info, f)
+            self._load(info)
+
+    # function to memory map a saved index, if there is one made from the reference as it is now
+    def _load(self, info):
+        try:
+            with open(self.info_name) as f:
+                if json.load(f) != info:
+                    return False
+            self.kmers = np.load(self.kmers_name, mmap_mode='r')
+            self.counts = np.load(self.counts_name, mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        return True
+
+    # function to count the k-mers of the reference, a chunk of each record at a time. To keep the memory used down, the
+    # counts of the chunks since the last merge are merged into the counts so far once they add up to more than a few
+    # chunks' worth and to more than the distinct k-mers merged already, so each k-mer is merged again only a few times
+    # however big the reference is.
+    def _build(self):
+        dtype = np.uint32 if self.k <= 16 else np.uint64
+        kmers, counts = [], []
+        pending = 0  # k-mers in the chunks since the last merge
+        merged = 0  # distinct k-mers in the counts merged so far
+        with FastaFile(self.reference) as fasta:
+            for ID, SEQ in fasta.records():
+                for start in range(0, max(len(SEQ) - self.k + 1, 0), chunk_bases):
+                    codes = encode(SEQ[start:start + chunk_bases + self.k - 1], self.k).astype(dtype)
+                    chunk_kmers, chunk_counts = np.unique(codes, return_counts=True)
+                    kmers.append(chunk_kmers)
+                    counts.append(chunk_counts.astype(np.uint32))
+                    pending += len(chunk_kmers)
+                    if pending > max(4 * chunk_bases, merged):
+                        merged_kmers, merged_counts = merge(kmers, counts)
+                        kmers, counts = [merged_kmers], [merged_counts]
+                        merged = len(merged_kmers)
+                        pending = 0
+        self.kmers, self.counts = merge(kmers, counts) if kmers else (np.zeros(0, dtype), np.zeros(0, np.uint32))
+
+    # function to return the number of places in the reference, on either strand, that each primer's 3' end could bind
+    # to: the last k bases of the primer with up to mismatches mismatches, none of them in the last clamp bases.
+    # Primers are given as sequences and the counts are returned as a numpy array in the same order.
+    def hits(self, primers, mismatches=1, clamp=3):
+        ends = [primer[-self.k:].upper() for primer in primers]
+        if any(len(end) < self.k for end in ends):
+            raise ValueError('Primers must be at least %d bases long for this index' % self.k)
+        bases = base_codes[np.frombuffer(''.join(ends).encode(), np.uint8)].reshape(len(ends), self.k)
+        codes = np.zeros(len(ends), np.uint64)
+        for j in range(self.k):
+            codes = (codes << np.uint64(2)) | (bases[:, j] & 3).astype(np.uint64)
+        # every mismatch variant of each primer end, and their reverse complements for binding to the other strand. A
+        # palindromic variant is the same site on both strands, so its reverse complement isn't counted again.
+        variants = codes[:, None] ^ mismatch_masks(self.k, mismatches, clamp)[None, :]
+        complements = reverse_complement_codes(variants, self.k)
+        counted = np.concatenate([np.ones(variants.shape, bool), complements != variants], axis=1).ravel()
+        variants = np.concatenate([variants, complements], axis=1)
+        hits = np.zeros(len(ends), np.int64)
+        if len(self.kmers):
+            flat = variants.ravel().astype(self.kmers.dtype)
+            # looking the k-mers up in sorted order keeps the binary searches on nearby pages of the index
+            order = np.argsort(flat)
+            positions = np.empty(len(flat), np.int64)
+            positions[order] = np.minimum(np.searchsorted(self.kmers, flat[order]), len(self.kmers) - 1)
+            found = (self.kmers[positions] == flat) & counted
+            hits = np.where(found, self.counts[positions], 0).reshape(variants.shape).sum(axis=1, dtype=np.int64)
+        # a primer with an N or other base in its 3' end can't be looked up
+        hits[(bases == 4).any(axis=1)] = -1
+        return hits
+
+
+### FUNCTIONS
+# function to return the 2 bit codes of every k-mer in a sequence as a numpy uint64 array. k-mers with a base other
+# than A, C, G or T are left out.
+def encode(sequence, k):
+    bases = base_codes[np.frombuffer(sequence.encode(), np.uint8)]
+    n = len(bases) - k + 1
+    if n <= 0:
+        return np.zeros(0, np.uint64)
+    codes = np.zeros(n, np.uint64)
+    for j in range(k):
+        codes = (codes << np.uint64(2)) | (bases[j:j + n] & 3).astype(np.uint64)
+    invalid = np.concatenate([[0], np.cumsum(bases == 4)])
+    return codes[invalid[k:] == invalid[:n]]
+
+
+# function to return the reverse complements of an array of k-mer codes
+def reverse_complement_codes(codes, k):
+    codes = codes ^ np.uint64((1 << 2 * k) - 1)
+    rc = np.zeros_like(codes)
+    for _ in range(k):
+        rc = (rc << np.uint64(2)) | (codes & np.uint64(3))
+        codes = codes >> np.uint64(2)
+    return rc
+
+
+# function to return the xor masks that turn a k-mer code into each of its variants with up to mismatches mismatches,
+# none of them in the last clamp bases (the 3' end of a primer). The first mask is 0, the k-mer itself.
+def mismatch_masks(k, mismatches, clamp):
+    masks = [0]
+    for n in range(1, mismatches + 1):
+        for positions in itertools.combinations(range(k - clamp), n):
+            for changes in itertools.product([1, 2, 3], repeat=n):
+                masks.append(sum(change << 2 * (k - 1 - position) for position, change in zip(positions, changes)))
+    return np.array(masks, np.uint64)
+
+
+# function to merge lists of sorted k-mer arrays and their counts into one sorted array of distinct k-mers and the total
+# count of each
+def merge(kmers, counts):
+    kmers, counts = np.concatenate(kmers), np.concatenate(counts)
+    order = np.argsort(kmers, kind='stable')
+    kmers, counts = kmers[order], counts[order]
+    if not len(kmers):
+        return kmers, counts
+    starts = np.flatnonzero(np.concatenate([[True], kmers[1:] != kmers[:-1]]))
+    return kmers[starts], np.add.reduceat(counts, starts).astype(np.uint32)
+
+
+# function to fill in the genome hits of the forward and reverse primer of each PrimerPair, returning the pairs whose
+# primers both have at most max_hits hits (all of them if max_hits is None). The hits of every primer in the list are
+# looked up together.
+def check_pairs(index, pairs, mismatches=1, clamp=3, max_hits=None):
+    hits = index.hits([pair.forward for pair in pairs] + [pair.reverse for pair in pairs], mismatches, clamp)
+    for pair, forward, reverse in zip(pairs, hits[:len(pairs)], hits[len(pairs):]):
+        pair.hits = [int(forward), int(reverse)]
+    if max_hits is None:
+        return pairs
+    return [pair for pair in pairs if max(pair.hits) <= max_hits]
@@ -0,0 +1,31 @@
+import argparse
+import os
+from PrimerRescore import conditions, rescore
+
+
+if __name__ == '__main__':
+    # argument parser for command line
+    parser = argparse.ArgumentParser(description='Primer re-scorer for new reaction conditions. The Tm, dimer, '
+                                     'hairpin, end stability and penalty columns are worked out again, the Primer '
+                                     'numbers are kept from the design.')
+    parser.add_argument('-i', '--input', help='.csv (or .csv.gz) of primers from FullDesigner or FlankingDesigner',
+                        required=True)
+    parser.add_argument('-o', '--output', help='.csv to write the re-scored primers to (default <input> rescored.csv)',
+                        default=None)
+    parser.add_argument('--monovalent', help='Monovalent salt concentration (mM)', default=50.0)
+    parser.add_argument('--divalent', help='Divalent salt (Mg2+) concentration (mM)', default=1.5)
+    parser.add_argument('--dntp', help='dNTP concentration (mM)', default=0.6)
+    parser.add_argument('--dna', help='Primer DNA concentration (nM)', default=50.0)
+    parser.add_argument('-w', '--workers', help='Number of worker processes to re-score primers with', default=1)
+    args = parser.parse_args()
+
+    if args.output is None:
+        stem, extension = os.path.splitext(args.input)
+        if extension == '.gz':
+            stem, extension = os.path.splitext(stem)
+            extension += '.gz'
+        args.output = stem + ' rescored' + extension
+    settings = conditions(PRIMER_SALT_MONOVALENT=float(args.monovalent), PRIMER_SALT_DIVALENT=float(args.divalent),
+                          PRIMER_DNTP_CONC=float(args.dntp), PRIMER_DNA_CONC=float(args.dna))
+    rows, oligos, pairs = rescore(args.input, args.output, settings, int(args.workers))
+    print('%d rows, %d primers and %d pairs re-scored, written to %s' % (rows, oligos, pairs, args.output))
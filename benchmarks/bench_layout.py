@@ -0,0 +1,54 @@
+# Benchmark of finding the CDS of a record: the designers' old per-base Python passes (counting the upper case bases,
+# find_CDS_start and SEQ.find) against RecordLayout's bytes passes, on random records with a range of flank lengths.
+# The CDS start and length from both are checked to be the same.
+#
+#   python benchmarks/bench_layout.py -g 200
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bench_window import random_record
+from PrimerFilters import RecordLayout
+
+
+# the function the designers used to find the CDS, which returns the first upper case base (not its position)
+def find_CDS_start(sequence):
+    for i in range(len(sequence)):
+        if sequence[i].isupper():
+            return sequence[i]
+
+
+# function to find the CDS start and length of a record as the designers used to
+def old_layout(SEQ):
+    CDS_len = sum(1 for c in SEQ if c.isupper())
+    CDS_start = SEQ.find(find_CDS_start(SEQ))
+    return CDS_start, CDS_len
+
+
+def new_layout(SEQ):
+    layout = RecordLayout(SEQ)
+    return layout.cds_start, layout.cds_len
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CDS layout benchmark')
+    parser.add_argument('-g', '--genes', help='Number of genes per flank length', default=200)
+    parser.add_argument('-c', '--cds', help='CDS length', default=1500)
+    parser.add_argument('-s', '--seed', help='Random seed', default=1)
+    args = parser.parse_args()
+    random.seed(int(args.seed))
+
+    print('%8s %14s %14s %8s %10s' % ('flank', 'old (us)', 'new (us)', 'speedup', 'identical'))
+    for flank in [200, 1000, 5000, 20000, 100000]:
+        records = [random_record('gene%d' % i, flank, int(args.cds))[1] for i in range(int(args.genes))]
+        timings = {}
+        results = {}
+        for name, layout in [('old', old_layout), ('new', new_layout)]:
+            start = time.perf_counter()
+            results[name] = [layout(SEQ) for SEQ in records]
+            timings[name] = (time.perf_counter() - start) / len(records) * 1e6
+        print('%8d %14.1f %14.1f %7.1fx %10s' % (flank, timings['old'], timings['new'], timings['old'] / timings['new'],
+                                                 results['old'] == results['new']))
@@ -0,0 +1,75 @@
+# Benchmark of the output formats (-f) against the plain .csv, with and without --coordinates: the time taken to write
+# the rows of a set of designed genes, the rows written per second and the size of the file. The primers are designed
+# once, for synthetic records as in bench_stages.py, and their rows written --repeat times over to make a larger file.
+# The csv.gz and jsonl files are read back and checked to hold the same rows as the .csv.
+#
+#   python benchmarks/bench_output.py -g 100 -r 20
+import argparse
+import csv
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FullDesigner
+from bench_stages import synthetic_full
+from PrimerFilters import RestrictionScanner
+from PrimerOutput import formats, open_writer
+from PrimerRecords import csv_headings
+
+
+# function to write every record's rows with the writer for fmt, returning the seconds taken and the file written
+def write_rows(fmt, filename, fieldnames, records):
+    start = time.perf_counter()
+    with open_writer(filename, fieldnames, fmt=fmt) as writer:
+        for index, (ID, rows) in enumerate(records):
+            writer.write_record(index, ID, rows)
+    return time.perf_counter() - start, writer.filename
+
+
+# function to read the rows of a csv or jsonl file (gzipped or not) back as lists of strings, as csv.reader gives them
+def read_rows(filename, fmt, fieldnames):
+    opener = gzip.open if fmt.endswith('.gz') else open
+    with opener(filename, 'rt', newline='') as f:
+        if fmt.startswith('csv'):
+            return list(csv.reader(f))[1:]
+        return [[str(value) for value in json.loads(line).values()] for line in f]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Output format benchmark')
+    parser.add_argument('-g', '--genes', help='Number of genes to design', default=100)
+    parser.add_argument('-r', '--repeat', help='Number of times to write the rows of every gene', default=20)
+    parser.add_argument('-s', '--seed', help='Random seed', default=1)
+    args = parser.parse_args()
+    random.seed(int(args.seed))
+
+    scanner = RestrictionScanner()
+    pairs = [FullDesigner.design_record(record, 5, 200, 500, scanner)
+             for record in synthetic_full(int(args.genes), 1000, 1500, 0.5)]
+    directory = tempfile.mkdtemp()
+    print('%-10s %-12s %10s %12s %10s %8s %8s' % ('format', 'product', 'time (s)', 'rows/s', 'size (MB)', 'vs csv',
+                                                   'same'))
+    for coordinates in [False, True]:
+        fieldnames = csv_headings(scanner, coordinates=coordinates)
+        records = [(record_pairs[0].gene if record_pairs else 'none', [pair.row(coordinates) for pair in record_pairs])
+                   for record_pairs in pairs] * int(args.repeat)
+        rows = sum(len(record_rows) for ID, record_rows in records)
+        csv_size = None
+        csv_rows = None
+        for fmt in formats:
+            seconds, filename = write_rows(fmt, os.path.join(directory, 'out' + formats[fmt]), fieldnames, records)
+            size = os.path.getsize(filename)
+            if fmt == 'csv':
+                csv_size = size
+                csv_rows = read_rows(filename, fmt, fieldnames)
+            same = read_rows(filename, fmt, fieldnames) == csv_rows if fmt in ['csv.gz', 'jsonl'] else ''
+            print('%-10s %-12s %10.2f %12.0f %10.2f %7.2fx %8s' % (os.path.splitext(filename)[1][1:] if fmt == 'parquet'
+                                                                  else fmt,
+                                                                  'coordinates' if coordinates else 'sequence',
+                                                                  seconds, rows / seconds, size / 1024 ** 2,
+                                                                  size / csv_size, same))
@@ -0,0 +1,81 @@
+# Benchmark of both designers with and without the GC/Tm prescreen (--prescreen), on random records whose flanks are
+# made of stretches of different GC content, from mostly AT rich (where the prescreen can exclude a lot) to even. For
+# each mix it reports the share of the flank bases excluded, the time per gene with and without the prescreen, and
+# whether the rows from both (every pair, not just the top ones) are identical.
+#
+#   python benchmarks/bench_prescreen.py -g 20
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FlankingDesigner
+import FullDesigner
+from PrimerFilters import RestrictionScanner
+from PrimerPrescreen import usable_bases
+
+# the GC contents that the stretches of each flank are picked from, for each mix
+mixes = {
+    'AT rich': [0.15, 0.25, 0.3, 0.5],
+    'patchy': [0.2, 0.3, 0.5, 0.6],
+    'even': [0.5],
+}
+
+
+### FUNCTIONS
+# function to make a random flank of length bases from stretches of 50-300 bases, each with a GC content picked from gcs
+def patchy_sequence(length, gcs):
+    bases = []
+    while len(bases) < length:
+        gc = random.choice(gcs)
+        bases += [random.choice('GC') if random.random() < gc else random.choice('AT')
+                  for _ in range(random.randint(50, 300))]
+    return ''.join(bases[:length])
+
+
+# function to make a record with lower case flanks of flank bases around an even upper case CDS of cds bases
+def random_record(ID, flank, cds, gcs):
+    return ID, (patchy_sequence(flank, gcs).lower() + patchy_sequence(cds, [0.5]) + patchy_sequence(flank, gcs).lower())
+
+
+# function to time design(record) for each record, returning the ms per record and the rows of every record
+def run(design, records):
+    start = time.perf_counter()
+    rows = [[pair.row() for pair in design(record)] for record in records]
+    return (time.perf_counter() - start) / len(records) * 1000, rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GC/Tm prescreen benchmark')
+    parser.add_argument('-g', '--genes', help='Number of genes per mix', default=20)
+    parser.add_argument('-f', '--flank', help='Flank length', default=1000)
+    parser.add_argument('-c', '--cds', help='CDS length', default=1500)
+    parser.add_argument('-s', '--seed', help='Random seed', default=1)
+    args = parser.parse_args()
+    random.seed(int(args.seed))
+
+    scanner = RestrictionScanner()
+    flank_global_args = {'PRIMER_MIN_SIZE': 18, 'PRIMER_MAX_SIZE': 30, 'PRIMER_MIN_TM': 50, 'PRIMER_MAX_TM': 60,
+                         'PRIMER_MIN_GC': 44.0, 'PRIMER_MAX_GC': 80.0}
+    print('%-18s %10s %14s %14s %8s %10s' % ('designer / mix', 'excluded', 'default (ms)', 'prescreen (ms)',
+                                             'speedup', 'identical'))
+    for mix, gcs in mixes.items():
+        records = [random_record('gene%d' % i, int(args.flank), int(args.cds), gcs) for i in range(int(args.genes))]
+        excluded = sum(int((~usable_bases(SEQ, flank_global_args)).sum()) for ID, SEQ in records)
+        excluded /= sum(len(SEQ) for ID, SEQ in records)
+        flanking_records = []
+        for ID, SEQ in records:
+            flanking_records.append((ID + '_LF', SEQ[:int(args.flank) + 200]))
+            flanking_records.append((ID + '_RF', SEQ[len(SEQ) - int(args.flank) - 200:]))
+
+        for name, design, designer_records in [
+                ('full', lambda r, p: FullDesigner.design_record(r, 5, 200, 500, scanner, prescreen=p), records),
+                ('flanking', lambda r, p: FlankingDesigner.design_record(r, 5, 200, 500, scanner, prescreen=p),
+                 flanking_records)]:
+            default_time, default_rows = run(lambda r: design(r, False), designer_records)
+            prescreen_time, prescreen_rows = run(lambda r: design(r, True), designer_records)
+            print('%-18s %9.1f%% %14.1f %14.1f %7.1fx %10s' % ('%s / %s' % (name, mix), excluded * 100, default_time,
+                                                              prescreen_time, default_time / prescreen_time,
+                                                              default_rows == prescreen_rows))
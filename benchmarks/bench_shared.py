@@ -0,0 +1,44 @@
+# Benchmark of FullDesigner with a primer3 design per flank against scoring the candidate primers once per gene and
+# pairing them in Python for both flanks (-s), on random records with CDSs short enough for the two flank windows to
+# overlap and long enough for them not to. The rows from both are checked to be identical.
+#
+#   python benchmarks/bench_shared.py -g 20
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FullDesigner
+from PrimerFilters import RestrictionScanner
+
+
+# function to make a random record with lower case flanks of flank bases and an upper case CDS of cds bases
+def random_record(ID, flank, cds):
+    return ID, (''.join(random.choice('acgt') for _ in range(flank)) +
+                ''.join(random.choice('ACGT') for _ in range(cds)) +
+                ''.join(random.choice('acgt') for _ in range(flank)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shared candidate benchmark')
+    parser.add_argument('-g', '--genes', help='Number of genes per CDS length', default=20)
+    parser.add_argument('-f', '--flank', help='Flank length', default=1000)
+    parser.add_argument('-s', '--seed', help='Random seed', default=1)
+    args = parser.parse_args()
+    random.seed(int(args.seed))
+
+    scanner = RestrictionScanner()
+    print('%8s %14s %14s %8s %10s' % ('cds', 'design (ms)', 'shared (ms)', 'speedup', 'identical'))
+    for cds in [150, 300, 600, 1500, 5000]:
+        records = [random_record('gene%d' % i, int(args.flank), cds) for i in range(int(args.genes))]
+        timings = {}
+        rows = {}
+        for shared in [False, True]:
+            start = time.perf_counter()
+            rows[shared] = [[pair.row() for pair in FullDesigner.design_record(r, 5, 200, 500, scanner, shared=shared)]
+                       for r in records]
+            timings[shared] = (time.perf_counter() - start) / len(records) * 1000
+        print('%8d %14.1f %14.1f %7.1fx %10s' % (cds, timings[False], timings[True], timings[False] / timings[True],
+                                                 rows[False] == rows[True]))
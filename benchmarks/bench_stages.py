@@ -0,0 +1,174 @@
+# Throughput benchmark of both designers on synthetic FASTA files, timing each stage separately: FASTA parsing, the
+# primer3 calls, restriction scanning, turning the primer3 output into PrimerPairs (post-processing) and writing the
+# .csv. The timings (per gene, best of --repeat runs) are written as JSON, and can be compared against an earlier JSON
+# file with --baseline, failing if any stage got slower by more than --threshold.
+#
+#   python benchmarks/bench_stages.py -g 50 -o before.json
+#   python benchmarks/bench_stages.py -g 50 -o after.json --baseline before.json --threshold 0.1
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import primer3
+import FlankingDesigner
+import FullDesigner
+from PrimerFasta import FastaFile
+from PrimerFilters import RestrictionScanner
+from PrimerOutput import CheckpointWriter
+from PrimerRecords import csv_headings
+
+# the stages timed for each designer, in the order they are reported
+stages = ['fasta parsing', 'primer3', 'restriction scanning', 'post-processing', 'csv writing', 'total']
+
+
+### FUNCTIONS
+# function to make a random sequence of length bases with a GC content of about gc
+def random_sequence(length, gc):
+    return ''.join(random.choice('GC') if random.random() < gc else random.choice('AT') for _ in range(length))
+
+
+# function to make the records for FullDesigner: lower case flanks of flank bases around an upper case CDS of cds bases
+def synthetic_full(genes, flank, cds, gc):
+    records = []
+    for i in range(genes):
+        records.append(('gene%d' % i, random_sequence(flank, gc).lower() + random_sequence(cds, gc) +
+                        random_sequence(flank, gc).lower()))
+    return records
+
+
+# function to make the records for FlankingDesigner: for each gene a _LF record of the left flank followed by the
+# start of the CDS, and a _RF record of the end of the CDS followed by the right flank (segment bases of CDS in each)
+def synthetic_flanking(genes, flank, cds, gc, segment=200):
+    records = []
+    for ID, SEQ in synthetic_full(genes, flank, cds, gc):
+        segment_len = min(segment, cds)
+        records.append((ID + '_LF', SEQ[:flank + segment_len]))
+        records.append((ID + '_RF', SEQ[len(SEQ) - flank - segment_len:]))
+    return records
+
+
+# function to write records to a FASTA file
+def write_fasta(records, filename):
+    with open(filename, 'w') as f:
+        for ID, SEQ in records:
+            f.write('>%s\n' % ID)
+            for i in range(0, len(SEQ), 60):
+                f.write(SEQ[i:i + 60] + '\n')
+
+
+# function to wrap func so that the time spent in it is added to timings[stage]
+def timed(func, timings, stage):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+    return wrapper
+
+
+# function to run one designer over a FASTA file the way its command line does, returning the seconds spent in each
+# stage. The primer3 calls and the PrimerPair building are timed by wrapping the functions the designer module calls,
+# and restriction scanning by a RestrictionScanner whose columns() is timed.
+def run_designer(module, filename, csvfilename):
+    timings = dict.fromkeys(stages, 0.0)
+    scanner = RestrictionScanner()
+    scanner.columns = timed(scanner.columns, timings, 'restriction scanning')
+    design_primers, primer_pairs = module.design_primers, module.primer_pairs
+    module.design_primers = timed(design_primers, timings, 'primer3')
+    module.primer_pairs = timed(primer_pairs, timings, 'post-processing')
+    try:
+        total = time.perf_counter()
+        start = time.perf_counter()
+        with FastaFile(filename) as fasta:
+            records = list(fasta.records())
+        timings['fasta parsing'] = time.perf_counter() - start
+
+        designed = [module.design_record(record, 5, 200, 500, scanner) for record in records]
+
+        start = time.perf_counter()
+        with CheckpointWriter(csvfilename, csv_headings(scanner)) as writer:
+            for index, (record, pairs) in enumerate(zip(records, designed)):
+                writer.write_record(index, record[0], [pair.row() for pair in pairs])
+        timings['csv writing'] = time.perf_counter() - start
+        timings['total'] = time.perf_counter() - total
+    finally:
+        module.design_primers, module.primer_pairs = design_primers, primer_pairs
+    # restriction scanning happens inside primer_pairs
+    timings['post-processing'] -= timings['restriction scanning']
+    return timings
+
+
+# function to compare the results against a baseline, returning a list of the stages that got slower by more than
+# threshold (as a fraction). Stages taking less than min_ms per gene in both are too noisy to compare and are skipped.
+def regressions(results, baseline, threshold, min_ms):
+    slower = []
+    for designer, timings in results['designers'].items():
+        for stage, ms in timings.items():
+            old = baseline['designers'].get(designer, {}).get(stage)
+            if old is None or max(ms, old) < min_ms:
+                continue
+            if ms > old * (1 + threshold):
+                slower.append('%s %s: %.3f ms -> %.3f ms per gene (+%.0f%%)'
+                              % (designer, stage, old, ms, (ms / old - 1) * 100))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per stage benchmark of both designers')
+    parser.add_argument('-g', '--genes', help='Number of genes', default=50)
+    parser.add_argument('-f', '--flank', help='Flank length', default=1000)
+    parser.add_argument('-c', '--cds', help='CDS length', default=1500)
+    parser.add_argument('--gc', help='GC content of the synthetic sequences', default=0.5)
+    parser.add_argument('-s', '--seed', help='Random seed', default=1)
+    parser.add_argument('-r', '--repeat', help='Number of runs, the fastest of which is kept', default=3)
+    parser.add_argument('-o', '--output', help='JSON file to write the results to', default=None)
+    parser.add_argument('-k', '--keep', help='Directory to keep the synthetic FASTA files in', default=None)
+    parser.add_argument('-b', '--baseline', help='JSON results of an earlier run to check for regressions', default=None)
+    parser.add_argument('-t', '--threshold', help='Fraction a stage may get slower by before failing', default=0.2)
+    parser.add_argument('--min-ms', help='Stages under this many ms per gene are not checked', default=0.05)
+    args = parser.parse_args()
+    random.seed(int(args.seed))
+    genes, flank, cds, gc = int(args.genes), int(args.flank), int(args.cds), float(args.gc)
+
+    directory = args.keep or tempfile.mkdtemp()
+    os.makedirs(directory, exist_ok=True)
+    inputs = {'full': (FullDesigner, os.path.join(directory, 'synthetic_full.fasta')),
+              'flanking': (FlankingDesigner, os.path.join(directory, 'synthetic_flanking.fasta'))}
+    write_fasta(synthetic_full(genes, flank, cds, gc), inputs['full'][1])
+    write_fasta(synthetic_flanking(genes, flank, cds, gc), inputs['flanking'][1])
+
+    results = {'settings': {'genes': genes, 'flank': flank, 'cds': cds, 'gc': gc, 'seed': int(args.seed),
+                            'repeat': int(args.repeat)},
+               'python': platform.python_version(), 'primer3': primer3.__version__, 'designers': {}}
+    print('%-9s' % 'designer' + ''.join('%22s' % stage for stage in stages) + '   (ms per gene)')
+    for designer, (module, filename) in inputs.items():
+        best = None
+        for _ in range(int(args.repeat)):
+            timings = run_designer(module, filename, os.path.join(directory, designer + '.csv'))
+            if best is None or timings['total'] < best['total']:
+                best = timings
+        results['designers'][designer] = {stage: best[stage] / genes * 1000 for stage in stages}
+        print('%-9s' % designer + ''.join('%22.3f' % results['designers'][designer][stage] for stage in stages))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != results['settings']:
+            print('Warning: the baseline was run with different settings: %s' % baseline['settings'])
+        slower = regressions(results, baseline, float(args.threshold), float(args.min_ms))
+        for line in slower:
+            print('Regression: ' + line)
+        if slower:
+            sys.exit(1)
+        print('No stage is more than %.0f%% slower than the baseline' % (float(args.threshold) * 100))
@@ -0,0 +1,39 @@
+# Benchmark of tiling a CDS with overlapping amplicons (FullDesigner -t) with a primer3 design for each amplicon
+# against scoring the candidate primers of the whole CDS once and pairing them in Python for each amplicon (-t -s), on
+# random records with a range of CDS lengths. The rows from both are checked to be identical.
+#
+#   python benchmarks/bench_tile.py -g 5
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FullDesigner
+from bench_shared import random_record
+from PrimerFilters import RestrictionScanner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tiling benchmark')
+    parser.add_argument('-g', '--genes', help='Number of genes per CDS length', default=5)
+    parser.add_argument('-f', '--flank', help='Flank length', default=1000)
+    parser.add_argument('-s', '--seed', help='Random seed', default=1)
+    args = parser.parse_args()
+    random.seed(int(args.seed))
+
+    scanner = RestrictionScanner()
+    print('%8s %8s %14s %14s %8s %10s' % ('cds', 'tiles', 'design (ms)', 'shared (ms)', 'speedup', 'identical'))
+    for cds in [1000, 3000, 10000, 30000]:
+        records = [random_record('gene%d' % i, int(args.flank), cds) for i in range(int(args.genes))]
+        timings = {}
+        rows = {}
+        for shared in [False, True]:
+            start = time.perf_counter()
+            rows[shared] = [[pair.row() for pair in FullDesigner.tile_record(r, 200, 500, scanner, shared=shared)]
+                            for r in records]
+            timings[shared] = (time.perf_counter() - start) / len(records) * 1000
+        tiles = sum(len(record_rows) for record_rows in rows[False]) / len(records)
+        print('%8d %8.1f %14.1f %14.1f %7.1fx %10s' % (cds, tiles, timings[False], timings[True],
+                                                       timings[False] / timings[True], rows[False] == rows[True]))
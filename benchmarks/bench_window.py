@@ -0,0 +1,43 @@
+# Benchmark of FullDesigner with and without cutting the template down to a window around each target before calling
+# primer3, on random records with multi-kb flanks. The rows from both are checked to be identical.
+#
+#   python benchmarks/bench_window.py -g 20
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import FullDesigner
+from PrimerFilters import RestrictionScanner
+
+
+# function to make a random record with lower case flanks of flank bases and an upper case CDS of cds bases
+def random_record(ID, flank, cds):
+    return ID, (''.join(random.choice('acgt') for _ in range(flank)) +
+                ''.join(random.choice('ACGT') for _ in range(cds)) +
+                ''.join(random.choice('acgt') for _ in range(flank)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Template windowing benchmark')
+    parser.add_argument('-g', '--genes', help='Number of genes per flank length', default=20)
+    parser.add_argument('-c', '--cds', help='CDS length', default=1500)
+    parser.add_argument('-s', '--seed', help='Random seed', default=1)
+    args = parser.parse_args()
+    random.seed(int(args.seed))
+
+    scanner = RestrictionScanner()
+    print('%8s %14s %14s %8s %10s' % ('flank', 'whole (ms)', 'window (ms)', 'speedup', 'identical'))
+    for flank in [500, 2000, 5000, 10000, 20000]:
+        records = [random_record('gene%d' % i, flank, int(args.cds)) for i in range(int(args.genes))]
+        timings = {}
+        rows = {}
+        for window in [False, True]:
+            start = time.perf_counter()
+            rows[window] = [[pair.row() for pair in FullDesigner.design_record(r, 5, 200, 500, scanner, window=window)]
+                       for r in records]
+            timings[window] = (time.perf_counter() - start) / len(records) * 1000
+        print('%8d %14.1f %14.1f %7.1fx %10s' % (flank, timings[False], timings[True], timings[False] / timings[True],
+                                                 rows[False] == rows[True]))